@@ -1,13 +1,14 @@
-import time
 import os
-import sqlite3
-from sqlite3 import Connection
-
-V100_DB_PATH = "../SQLiteDBs/A4v100.db"
-V1K_DB_PATH = "../SQLiteDBs/A4v1k.db"
-V10K_DB_PATH = "../SQLiteDBs/A4v10k.db"
-V100K_DB_PATH = "../SQLiteDBs/A4v100k.db"
-V1M_DB_PATH = "../SQLiteDBs/A4v1M.db"
+import benchmark
+import columnar
+import connection_pool
+import layouts
+import query_executor
+import result_cache
+import summary
+import tiers
+import tuning
+from typing import Dict
 
 # Q3: Considering the set of countries that exist in relation Parts, find the average price of the parts made in each country 
 
@@ -46,79 +47,75 @@ DROP_INDEX_QUERY_IF_EXISTS = '''
          DROP INDEX IF EXISTS idxMadeIn;
     '''
 
-Connection = sqlite3.Connection
-
-
-def connect(path) -> Connection:
-
-    # Returns a connection to the database provided at the path.
-    connection = sqlite3.connect(path)
-    cursor = connection.cursor()
-    # To enable foreign keys for SQLite
-    cursor.execute(' PRAGMA foreign_keys=ON; ')
-    connection.commit()
-    return connection
-
 
 def main():
-    options = {"100": V100_DB_PATH, "1K": V1K_DB_PATH,
-            "10K": V10K_DB_PATH, "100K": V100K_DB_PATH, "1M": V1M_DB_PATH}
+    options = tiers.TIERS
+    benchmark.set_context(application="A4P2",
+                          fetch=query_executor.FETCH_STRATEGY,
+                          backend=summary.backend(),
+                          cache="on" if result_cache.ENABLED else "off",
+                          layout=layouts.LAYOUT,
+                          profile=tuning.PROFILE,
+                          cache_state=tuning.STATE)
     print("Executing Part 2\n")
 
-    update_index(options, DROP_INDEX_QUERY_IF_EXISTS)
+    tiers.update_indexes(options, DROP_INDEX_QUERY_IF_EXISTS)
 
-    print("Avg times and sizes for Query 3 without index\n")
-    run_trials(options)
+    try:
+        benchmark.set_context(query="Q3", index="off")
+        print("Avg times and sizes for Query 3 without index\n")
+        run_trials(options)
 
-    print("Creating index for each database\n")
-    update_index(options, CREATE_INDEX_QUERY)
+        print("Creating index for each database\n")
+        tiers.update_indexes(options, CREATE_INDEX_QUERY)
 
-    print("Avg times and sizes for Query 3 with index\n")
-    run_trials(options)
+        benchmark.set_context(query="Q3", index="on")
+        print("Avg times and sizes for Query 3 with index\n")
+        run_trials(options)
 
-    print("Dropping index for each database\n")
-    update_index(options, DROP_INDEX_QUERY)
+        print("Dropping index for each database\n")
+        tiers.update_indexes(options, DROP_INDEX_QUERY)
+    finally:
+        summary.remove_built()
 
+    connection_pool.print_stats()
+    query_executor.print_stats()
+    result_cache.print_stats()
+    connection_pool.close_all()
+    benchmark.write_results()
     print("Done!")
 
 
-def update_index(options, query):
-    for option in options:
-        path = options[option]
-        connection = connect(path)
-        cursor = connection.cursor()
-        cursor.execute(query)
-        connection.commit()
-        connection.close()
-
-
 def run_trials(options):
     for option in options:
         print("Avg time for {} entries".format(option))
+        benchmark.set_context(tier=option)
         avg_time(options[option])
-        print("Size of database {}".format(os.stat(options[option]).st_size))
+        print("Size of database {}".format(os.stat(
+            connection_pool.exact_path(options[option])).st_size))
         print("\n")
 
 
 def avg_time(path) -> None:
-    total_time = 0
-    for i in range(0, 100):
-        t_start = time.process_time()
-        run_query(path)
-        t_taken = time.process_time() - t_start
-        total_time += t_taken
-    # to get the average for total_time
-    total_time = total_time/100
-    # display in ms
-    print("Avg time: {} ms".format(total_time*1000))
-
-
-def run_query(path) -> None:
-    connection = connect(path)
-    cursor = connection.cursor()
-    cursor.execute(QUERY_3)
-    connection.commit()
-    connection.close()
+    if columnar.enabled():
+        columnar.verify(path, "Q3", QUERY_3)
+    if summary.enabled():
+        summary.ensure(path)
+        summary.verify(path, "Q3", QUERY_3)
+    result = benchmark.run_benchmark(run_query, path)
+    benchmark.print_result(result)
+
+
+def run_query(path) -> Dict[str, int]:
+    if columnar.enabled():
+        return columnar.execute(path, "Q3")
+    if summary.enabled():
+        return result_cache.execute_read(path, summary.QUERY_3)
+    return result_cache.execute_read(path, QUERY_3)
+
+
+# timed function for each query, used by parallel_runner.py
+QUERIES = {"Q3": run_query}
 
 
 if __name__ == "__main__":
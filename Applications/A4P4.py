@@ -1,17 +1,18 @@
 
 
 #!/usr/bin/env python3
-import time
 import os
 import sqlite3
-from sqlite3 import Connection
-from typing import List
-
-V100_DB_PATH = "../SQLiteDBs/A4v100.db"
-V1K_DB_PATH = "../SQLiteDBs/A4v1k.db"
-V10K_DB_PATH = "../SQLiteDBs/A4v10k.db"
-V100K_DB_PATH = "../SQLiteDBs/A4v100k.db"
-V1M_DB_PATH = "../SQLiteDBs/A4v1M.db"
+import benchmark
+import columnar
+import connection_pool
+import layouts
+import phases
+import query_executor
+import query_plan
+import tiers
+import tuning
+from typing import Dict, List, Optional, Tuple
 
 # Q5: Find the quantity of parts that are not used in any other part, your query must use EXISTS.
 
@@ -73,6 +74,95 @@ QUERY_6 = '''
         );
     '''
 
+# Q5join: Q5 as an anti-join, the parts whose LEFT JOIN to a part needing
+# them finds nothing.
+
+# select
+#     count(p.partNumber)
+# from
+#     Parts p
+#     left join Parts p2 on p2.needsPart = p.partNumber
+# where
+#     p2.partNumber is null;
+
+QUERY_5_JOIN = '''
+    select
+        count(p.partNumber)
+    from
+        Parts p
+        left join Parts p2 on p2.needsPart = p.partNumber
+    where
+        p2.partNumber is null;
+    '''
+
+# Q5except: Q5 as a compound query, every partNumber EXCEPT the needed ones.
+
+# select
+#     count(*)
+# from
+#     (
+#         select partNumber from Parts
+#         except
+#         select needsPart from Parts
+#     );
+
+QUERY_5_EXCEPT = '''
+    select
+        count(*)
+    from
+        (
+            select partNumber from Parts
+            except
+            select needsPart from Parts
+        );
+    '''
+
+# Q5temp: Q5 against NeededParts, the distinct needsPart values aggregated
+# into a temp table keyed on them. Every run builds and drops it.
+
+CREATE_NEEDED_QUERY = '''
+    CREATE TEMP TABLE NeededParts (
+        partNumber INTEGER PRIMARY KEY
+    );
+'''
+
+FILL_NEEDED_QUERY = '''
+    INSERT INTO temp.NeededParts
+        select distinct needsPart from Parts where needsPart is not null;
+'''
+
+DROP_NEEDED_QUERY = '''
+    DROP TABLE IF EXISTS temp.NeededParts;
+'''
+
+QUERY_5_TEMP = '''
+    select
+        count(partNumber)
+    from
+        Parts p
+    where
+        not exists (
+            select
+                1
+            from
+                temp.NeededParts n
+            where
+                n.partNumber = p.partNumber
+        );
+    '''
+
+# Q5set reads both columns in sorted order and takes the difference in
+# Python (NumPy when it is installed), streaming the partNumbers.
+
+PART_NUMBERS_QUERY = '''
+    select partNumber from Parts order by partNumber;
+    '''
+
+NEEDED_PARTS_QUERY = '''
+    select distinct needsPart from Parts where needsPart is not null
+    order by needsPart;
+    '''
+
 # Creates an index for Q6
 
 # CREATE INDEX idxPartNumberNeedsPart on Parts ( needsPart, partNumber );
@@ -88,92 +178,231 @@ CREATE_INDEX_QUERY = '''
 DROP_INDEX_QUERY = '''
     DROP INDEX idxPartNumberNeedsPart;
 '''
-country_list = None
 
+# Drops the index if it exists
 
-def main():
-    options = {"100": V100_DB_PATH, "1K": V1K_DB_PATH,
-               "10K": V10K_DB_PATH, "100K": V100K_DB_PATH, "1M": V1M_DB_PATH}
+# DROP INDEX IF EXISTS idxPartNumberNeedsPart;
+
+DROP_INDEX_QUERY_IF_EXISTS = '''
+    DROP INDEX IF EXISTS idxPartNumberNeedsPart;
+'''
+# Seconds one measurement may take. A strategy whose single run is slower
+# is skipped, and the iterations of a faster one are cut to fit.
+TIME_BUDGET = float(os.environ.get("BENCH_TIME_BUDGET", 10))
+
+# the SQLite strategies, by name
+SQL = {"Q5": QUERY_5, "Q6": QUERY_6, "Q5join": QUERY_5_JOIN,
+       "Q5except": QUERY_5_EXCEPT}
 
+
+def main():
+    options = tiers.TIERS
+
+    benchmark.set_context(application="A4P4",
+                          fetch=query_executor.FETCH_STRATEGY,
+                          backend=columnar.BACKEND,
+                          layout=layouts.LAYOUT,
+                          profile=tuning.PROFILE,
+                          cache_state=tuning.STATE)
     print("Executing Part 4\n")
 
-    print("Avg times and sizes for Query 5 without index\n")
-    run_trials(options, QUERY_5)
+    tiers.update_indexes(options, DROP_INDEX_QUERY_IF_EXISTS)
 
-    print("Avg times and sizes for Query 6 without index\n")
-    run_trials(options, QUERY_6)
+    benchmark.set_context(index="off")
+    print("Avg times and sizes for every Q5/Q6 strategy without index\n")
+    run_trials(options)
 
     print("Creating index for each database")
 
-    update_index(options, CREATE_INDEX_QUERY)
+    tiers.update_indexes(options, CREATE_INDEX_QUERY)
 
-    print("Avg times and sizes for Query 6 with index\n")
-    run_trials(options, QUERY_6)
+    benchmark.set_context(index="on")
+    print("Avg times and sizes for every Q5/Q6 strategy with index\n")
+    run_trials(options)
 
     print("Dropping index for each database\n")
 
-    update_index(options, DROP_INDEX_QUERY)
+    tiers.update_indexes(options, DROP_INDEX_QUERY)
+    connection_pool.print_stats()
+    query_executor.print_stats()
+    connection_pool.close_all()
+    benchmark.write_results()
     print("Done!")
 
 
-def update_index(options, query):
+def run_trials(options):
     for option in options:
         path = options[option]
-        connection = connect(path)
-        cursor = connection.cursor()
-        cursor.execute(query)
-        connection.commit()
-        connection.close()
-
-
-def run_trials(options, query):
-    for option in options:
         print("Avg time for {} entries".format(option))
-        avg_time(options[option], query)
-        print("Size of database {}".format(os.stat(options[option]).st_size))
+        benchmark.set_context(tier=option)
+        # timings of strategies that disagree are not comparable
+        if not verify(path):
+            print("Skipping {} entries, the strategies disagree\n".format(
+                option))
+            continue
+        for name in QUERIES:
+            avg_time(path, name)
+        print("Size of database {}".format(
+            os.stat(connection_pool.exact_path(path)).st_size))
         print("\n")
 
 
-def connect(path) -> Connection:
-    # Returns a connection to the database provided at the path.
-    db_path = exact_path(path)
-    connection = sqlite3.connect(db_path)
-    cursor = connection.cursor()
-    # To enable foreign keys for SQLite
-    cursor.execute(' PRAGMA foreign_keys=ON; ')
-    connection.commit()
-    return connection
-
-
-def exact_path(path) -> str:
-    # Used to convert relative path to absolute path.
-    curr = os.path.dirname(__file__)
-    load_path = os.path.join(curr, path)
-    return load_path
-
-
-def run_query(path, query) -> None:
-    connection = connect(path)
-    cursor = connection.cursor()
-    cursor.execute(query, {})
-    connection.commit()
-    connection.close()
+def read_needed(path, into=None) -> Dict[str, int]:
+    # Runs Q5temp: builds NeededParts, counts the parts it does not have and
+    # drops it again, so every run pays for the build. PRAGMA query_only
+    # blocks temp tables too, so this runs on the read-write connection.
+    with connection_pool.connection(path) as connection:
+        query_executor.set_time_limit(connection)
+        try:
+            with phases.phase("build"):
+                connection.execute(CREATE_NEEDED_QUERY)
+                connection.execute(FILL_NEEDED_QUERY)
+            with phases.phase("commit"):
+                connection.commit()
+            query_executor.track_statement(connection, QUERY_5_TEMP)
+            with phases.phase("execute"):
+                cursor = connection.execute(QUERY_5_TEMP)
+            with phases.phase("fetch"):
+                result = query_executor.drain(cursor, into=into)
+            query_plan.capture(connection, connection_pool.exact_path(path),
+                               QUERY_5_TEMP, {}, counters=False)
+            return result
+        finally:
+            # an interrupted run is past its deadline, so the clean up runs
+            # without the time limit
+            connection.set_progress_handler(None, 0)
+            connection.rollback()
+            connection.execute(DROP_NEEDED_QUERY)
+
+
+class MissingParts:
+    # Counts the partNumbers, handed over in sorted batches through
+    # extend() as drain() does with its rows, that are not in needed, the
+    # sorted distinct needsParts. Only needed is held in memory.
+    __slots__ = ("needed", "np", "j", "count")
+
+    def __init__(self, needed):
+        # without numpy, the batches are merged with the sorted list
+        self.np = columnar.numpy()
+        if self.np is not None:
+            needed = self.np.fromiter(needed, self.np.int64, len(needed))
+        self.needed = needed
+        self.j = 0
+        self.count = 0
+
+    def extend(self, batch) -> None:
+        needed = self.needed
+        if self.np is not None:
+            np = self.np
+            nums = np.fromiter((row[0] for row in batch), np.int64,
+                               len(batch))
+            found = 0
+            if len(needed):
+                at = np.minimum(np.searchsorted(needed, nums),
+                                len(needed) - 1)
+                found = int(np.count_nonzero(needed[at] == nums))
+            self.count += len(nums) - found
+            return
+        for (num,) in batch:
+            while self.j < len(needed) and needed[self.j] < num:
+                self.j += 1
+            if self.j == len(needed) or needed[self.j] != num:
+                self.count += 1
+
+
+def count_set_difference(path) -> Tuple[int, Dict[str, int]]:
+    # Parts that no part needs, as the difference of the sorted partNumbers
+    # and the sorted distinct needsParts, with what both queries delivered.
+    # The partNumbers are streamed with fetchmany() instead of being read
+    # into a list.
+    with connection_pool.connection(path, read_only=True) as connection:
+        needed: List[tuple] = []
+        counts = query_executor.run_read(connection, path, NEEDED_PARTS_QUERY,
+                                         {}, into=needed)
+        missing = MissingParts([row[0] for row in needed])
+        query_executor.track_statement(connection, PART_NUMBERS_QUERY)
+        with phases.phase("execute"):
+            cursor = connection.execute(PART_NUMBERS_QUERY)
+        with phases.phase("fetch"):
+            parts = query_executor.drain(cursor, "fetchmany", into=missing)
+        query_plan.capture(connection, connection_pool.exact_path(path),
+                           PART_NUMBERS_QUERY, {})
+    return missing.count, {"rows": counts["rows"] + parts["rows"],
+                           "bytes": counts["bytes"] + parts["bytes"]}
+
+
+def count(path, name) -> int:
+    # The answer of strategy name, untimed.
+    if name in SQL:
+        return query_executor.fetch_read(path, SQL[name])[0][0]
+    if name == "Q5temp":
+        rows: List[tuple] = []
+        read_needed(path, into=rows)
+        return rows[0][0]
+    return count_set_difference(path)[0]
+
+
+def verify(path) -> bool:
+    # Checks that every strategy counts the same parts. NOT IN is unknown
+    # for every part once needsPart has a NULL, so Q6 then counts 0.
+    # Strategies over the time budget are left out.
+    answers: Dict[str, Optional[int]] = {}
+    query_executor.TIME_LIMIT = TIME_BUDGET
+    try:
+        for name in QUERIES:
+            try:
+                answers[name] = count(path, name)
+            except sqlite3.OperationalError as error:
+                if "interrupted" not in str(error):
+                    raise
+                answers[name] = None
+        has_null = query_executor.fetch_read(
+            path, "select count(*) - count(needsPart) from Parts;")[0][0] > 0
+    finally:
+        query_executor.TIME_LIMIT = None
+    known = [answer for name, answer in answers.items()
+             if answer is not None and name != "Q6"]
+    if not known:
+        return True
+    matched = True
+    for name, answer in answers.items():
+        expected = 0 if name == "Q6" and has_null else known[0]
+        if answer is not None and answer != expected:
+            print("{} counts {} parts, expected {}".format(
+                name, answer, expected))
+            matched = False
+    return matched
+
+
+def run_query(path, name) -> Dict[str, int]:
+    if columnar.enabled() and name in ("Q5", "Q6"):
+        return columnar.execute(path, name)
+    if name in SQL:
+        return query_executor.execute_read(path, SQL[name])
+    if name == "Q5temp":
+        return read_needed(path)
+    return count_set_difference(path)[1]
+
+
+def avg_time(path, name) -> None:
+    print("{}:".format(name))
+    benchmark.set_context(query=name)
+    if columnar.enabled() and name in ("Q5", "Q6"):
+        columnar.verify(path, name, SQL[name])
+    result = benchmark.run_within(run_query, path, name, budget=TIME_BUDGET)
+    if result is None:
+        print("Skipping, one run takes over {} s".format(TIME_BUDGET))
+        return
+    benchmark.print_result(result)
 
 
-def avg_time(path, query) -> None:
-    total_time = 0
-    if path in {V100K_DB_PATH, V1M_DB_PATH} and query is QUERY_5:
-        print("Skipping this Database")
-        return
-    for i in range(0, 100):
-        t_start = time.process_time()
-        run_query(path, query)
-        t_taken = time.process_time() - t_start
-        total_time += t_taken
-    # to get the average for total_time
-    total_time = total_time/100
-    # display in ms
-    print("Avg time: {} ms".format(total_time*1000))
+# timed function for each query, used by parallel_runner.py
+QUERIES = {"Q5": lambda path: run_query(path, "Q5"),
+           "Q6": lambda path: run_query(path, "Q6"),
+           "Q5join": lambda path: run_query(path, "Q5join"),
+           "Q5except": lambda path: run_query(path, "Q5except"),
+           "Q5temp": lambda path: run_query(path, "Q5temp"),
+           "Q5set": lambda path: run_query(path, "Q5set")}
 
 
 if __name__ == "__main__":
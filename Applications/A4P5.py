@@ -0,0 +1,233 @@
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import time
+from typing import Dict, List
+
+import A4P1
+import A4P2
+import A4P3
+import A4P4
+import benchmark
+import connection_pool
+import summary
+import tiers
+import workload
+
+# W1: insert parts with fresh UPCs, W2: change the price of existing parts,
+# W3: delete the parts W1 inserted, so every run ends with the rows it
+# started with.
+
+INSERT_QUERY = '''
+        INSERT INTO Parts
+            VALUES(:num, :price, :needs, :country);
+    '''
+
+UPDATE_QUERY = '''
+        UPDATE Parts
+        SET
+            partPrice = :price
+        WHERE
+            partNumber = :num;
+    '''
+
+DELETE_QUERY = '''
+        DELETE FROM Parts
+        WHERE
+            partNumber = :num;
+    '''
+
+# the index each read application creates
+APPLICATIONS = {"A4P1": A4P1, "A4P2": A4P2, "A4P3": A4P3, "A4P4": A4P4}
+
+# index sets to measure: none, each application's index alone, or all
+INDEX_SETS = ["none"] + list(APPLICATIONS) + ["all"]
+
+
+def scratch_path(path) -> str:
+    # Writes go to a copy of the tier so the benchmark databases are never
+    # changed.
+    return connection_pool.exact_path(path) + ".write.db"
+
+
+def make_scratch(path) -> str:
+    scratch = scratch_path(path)
+    remove_scratch(path)
+    shutil.copyfile(connection_pool.exact_path(path), scratch)
+    return scratch
+
+
+def remove_scratch(path) -> None:
+    scratch = scratch_path(path)
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        if os.path.exists(scratch + suffix):
+            os.remove(scratch + suffix)
+
+
+def connect(scratch, journal) -> sqlite3.Connection:
+    # Autocommit, so the transactions are exactly the ones run_writes()
+    # opens.
+    connection = sqlite3.connect(scratch, isolation_level=None)
+    connection.execute(' PRAGMA journal_mode={}; '.format(journal))
+    if journal.upper() == "WAL":
+        # no automatic checkpoints inside the timed writes, so the WAL holds
+        # every page a step wrote and checkpoint() times folding them all
+        connection.execute(' PRAGMA wal_autocheckpoint=0; ')
+    return connection
+
+
+def use_indexes(connection, index_set) -> None:
+    for app in APPLICATIONS.values():
+        connection.execute(app.DROP_INDEX_QUERY_IF_EXISTS)
+    for name, app in APPLICATIONS.items():
+        if index_set in (name, "all"):
+            connection.execute(app.CREATE_INDEX_QUERY)
+
+
+def fresh_rows(connection, path, rows) -> List[dict]:
+    # Parts whose UPCs are above every partNumber and needsPart in the tier.
+    top = connection.execute(
+        "select max(partNumber), max(needsPart) from Parts").fetchone()
+    start = max(top[0] or 0, top[1] or 0) + 1
+    codes = workload.keys_of(path, "madeIn")
+    needs = workload.keys_of(path, "needsPart")
+    return [{"num": start + i, "price": random.randint(0, 100),
+             "needs": random.choice(needs), "country": random.choice(codes)}
+            for i in range(0, rows)]
+
+
+def run_writes(connection, query, params, batch_size, txn_size) -> float:
+    # Runs query for every entry of params, batch_size per executemany()
+    # and txn_size per transaction. Returns the time taken in seconds.
+    t_start = time.perf_counter()
+    for txn_start in range(0, len(params), txn_size):
+        connection.execute('BEGIN')
+        txn_end = min(txn_start + txn_size, len(params))
+        for batch_start in range(txn_start, txn_end, batch_size):
+            connection.executemany(
+                query, params[batch_start:min(batch_start + batch_size,
+                                              txn_end)])
+        connection.execute('COMMIT')
+    return time.perf_counter() - t_start
+
+
+def checkpoint(connection, scratch, journal) -> Dict[str, float]:
+    # Size the WAL grew to over the step and how long it takes to fold it
+    # back into the database file.
+    if journal.upper() != "WAL":
+        return {}
+    wal = scratch + "-wal"
+    wal_bytes = os.stat(wal).st_size if os.path.exists(wal) else 0
+    t_start = time.perf_counter()
+    busy, frames, done = connection.execute(
+        ' PRAGMA wal_checkpoint(TRUNCATE); ').fetchone()
+    return {"wal_bytes": wal_bytes, "wal_frames": frames,
+            "checkpoint_ms": (time.perf_counter() - t_start) * 1000}
+
+
+def run_config(connection, path, scratch, journal, batch_size, txn_size,
+               rows) -> List[dict]:
+    inserted = fresh_rows(connection, path, rows)
+    parts = workload.keys_of(path, "partNumber")
+    updates = [{"num": random.choice(parts), "price": random.randint(0, 100)}
+               for i in range(0, rows)]
+    steps = [("insert", INSERT_QUERY, inserted),
+             ("update", UPDATE_QUERY, updates),
+             ("delete", DELETE_QUERY, [{"num": row["num"]}
+                                       for row in inserted])]
+    measured = []
+    for name, query, params in steps:
+        t_taken = run_writes(connection, query, params, batch_size, txn_size)
+        result = dict(benchmark.context)
+        result.update(operation=name, batch_size=batch_size,
+                      txn_size=txn_size, rows=len(params),
+                      wall_ms=t_taken * 1000,
+                      rows_per_sec=len(params) / t_taken if t_taken else 0)
+        result.update(checkpoint(connection, scratch, journal))
+        result["db_size"] = os.stat(scratch).st_size
+        measured.append(result)
+        benchmark.results.append(result)
+        print_result(result)
+    return measured
+
+
+def print_result(result) -> None:
+    line = "{:<7} batch {:>6} txn {:>6}: {:>10.0f} rows/sec".format(
+        result["operation"], result["batch_size"], result["txn_size"],
+        result["rows_per_sec"])
+    if "checkpoint_ms" in result:
+        line += ", WAL {} B, checkpoint {:.2f} ms".format(
+            result["wal_bytes"], result["checkpoint_ms"])
+    print(line)
+
+
+def run_tier(tier, args) -> None:
+    path = tiers.TIERS[tier]
+    scratch = make_scratch(path)
+    # a summary built by summary.py build or DBINIT_SUMMARY stays in the
+    # tier, and its triggers slow every write
+    connection = sqlite3.connect(scratch)
+    triggered = summary.triggered(connection)
+    connection.close()
+    if triggered:
+        summary.warn_triggered(tier)
+    try:
+        for index_set in args.indexes:
+            for journal in args.journals:
+                connection = connect(scratch, journal)
+                use_indexes(connection, index_set)
+                benchmark.set_context(tier=tier, index=index_set,
+                                      journal=journal,
+                                      summary="on" if triggered else "off")
+                print("Writes on {} entries, indexes: {}, journal: {}".format(
+                    tier, index_set, journal))
+                for batch_size in args.batch_sizes:
+                    for txn_size in args.txn_sizes:
+                        if txn_size < batch_size:
+                            continue
+                        run_config(connection, path, scratch, journal,
+                                   batch_size, txn_size, args.rows)
+                # leave WAL mode so the next journal starts from a clean file
+                connection.execute(' PRAGMA journal_mode=DELETE; ')
+                connection.close()
+                print("\n")
+    finally:
+        remove_scratch(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure insert, update and delete throughput on a copy "
+                    "of each tier for batch sizes, transaction sizes, "
+                    "journal modes and index sets.")
+    parser.add_argument("--tiers", nargs="+", default=["10K", "100K"],
+                        choices=list(tiers.TIERS))
+    parser.add_argument("--rows", type=int, default=10000,
+                        help="rows inserted, updated and deleted per run")
+    parser.add_argument("--batch-sizes", nargs="+", type=int,
+                        default=[1, 100, 1000])
+    parser.add_argument("--txn-sizes", nargs="+", type=int,
+                        default=[1000, 10000])
+    parser.add_argument("--journals", nargs="+", default=["DELETE", "WAL"],
+                        choices=["DELETE", "WAL"])
+    parser.add_argument("--indexes", nargs="+", default=INDEX_SETS,
+                        choices=INDEX_SETS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=benchmark.OUTPUT)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    workload.seed(args.seed)
+    benchmark.set_context(application="A4P5")
+    print("Executing Part 5\n")
+    for tier in args.tiers:
+        run_tier(tier, args)
+    connection_pool.close_all()
+    benchmark.write_results(args.output)
+    print("Done!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+import bisect
+import os
+import tiers
+import time
+from array import array
+from typing import Dict
+
+import benchmark
+import connection_pool
+import key_sampler
+import layouts
+import query_executor
+import tuning
+import workload
+
+# Parts is a dependency graph: every part has an edge partNumber -> needsPart
+# when the part it needs is in Parts too.
+
+# Q7: Given a part, find every part it transitively needs (the explosion of
+# its bill of materials), how deep the explosion goes and the total price of
+# the part and everything it needs. path holds the parts visited so far so a
+# cycle stops the recursion.
+
+QUERY_7 = '''
+        with recursive bom(partNumber, partPrice, needsPart, depth, path) as (
+            select
+                partNumber, partPrice, needsPart, 0,
+                ',' || partNumber || ','
+            from
+                Parts
+            where
+                partNumber = :num
+            union all
+            select
+                p.partNumber, p.partPrice, p.needsPart, b.depth + 1,
+                b.path || p.partNumber || ','
+            from
+                bom b
+                join Parts p on p.partNumber = b.needsPart
+            where
+                instr(b.path, ',' || p.partNumber || ',') = 0
+        )
+        select
+            count(*) - 1, max(depth), sum(partPrice),
+            max(instr(path, ',' || needsPart || ',') > 0)
+        from
+            bom;
+    '''
+
+# Q8: Given a part, find every part that transitively needs it (where it is
+# used), how deep that goes and the total price of those parts and itself.
+
+QUERY_8 = '''
+        with recursive bom(partNumber, partPrice, depth, path) as (
+            select
+                partNumber, partPrice, 0, ',' || partNumber || ','
+            from
+                Parts
+            where
+                partNumber = :num
+            union all
+            select
+                p.partNumber, p.partPrice, b.depth + 1,
+                b.path || p.partNumber || ','
+            from
+                bom b
+                join Parts p on p.needsPart = b.partNumber
+            where
+                instr(b.path, ',' || p.partNumber || ',') = 0
+        )
+        select
+            count(*) - 1, max(depth), sum(partPrice),
+            max(exists (
+                select
+                    1
+                from
+                    Parts p
+                where
+                    p.needsPart = bom.partNumber
+                    and instr(bom.path, ',' || p.partNumber || ',') > 0
+            ))
+        from
+            bom;
+    '''
+
+# Creates an index for Q8, covering the parts that need a given part
+
+# CREATE INDEX idxNeedsPartPrice ON Parts ( needsPart, partPrice );
+
+CREATE_INDEX_QUERY = '''
+        CREATE INDEX idxNeedsPartPrice ON Parts ( needsPart, partPrice );
+    '''
+
+# DROP INDEX idxNeedsPartPrice;
+
+DROP_INDEX_QUERY = '''
+        DROP INDEX idxNeedsPartPrice;
+    '''
+
+# DROP INDEX IF EXISTS idxNeedsPartPrice;
+
+DROP_INDEX_QUERY_IF_EXISTS = '''
+        DROP INDEX IF EXISTS idxNeedsPartPrice;
+    '''
+
+# parts checked with both implementations before timing
+VERIFY_KEYS = 20
+
+# graphs loaded from Parts, keyed by absolute database path, with the
+# identity of the file they were loaded from
+graphs: Dict[str, dict] = {}
+
+
+def main():
+    options = tiers.TIERS
+    benchmark.set_context(application="A4P6",
+                          fetch=query_executor.FETCH_STRATEGY,
+                          keys=workload.DISTRIBUTION,
+                          layout=layouts.LAYOUT,
+                          profile=tuning.PROFILE,
+                          cache_state=tuning.STATE)
+    print("Executing Part 6\n")
+
+    tiers.update_indexes(options, DROP_INDEX_QUERY_IF_EXISTS)
+
+    benchmark.set_context(index="off")
+    print("Avg times for Query 7 and Query 8 without index\n")
+    run_trials(options)
+
+    print("Creating index for each database\n")
+    tiers.update_indexes(options, CREATE_INDEX_QUERY)
+
+    benchmark.set_context(index="on")
+    print("Avg times for Query 7 and Query 8 with index\n")
+    run_trials(options)
+
+    print("Dropping index for each database\n")
+    tiers.update_indexes(options, DROP_INDEX_QUERY)
+
+    connection_pool.print_stats()
+    query_executor.print_stats()
+    connection_pool.close_all()
+    benchmark.write_results()
+    print("Done!")
+
+
+def run_trials(options):
+    for option in options:
+        path = options[option]
+        print("Avg time for {} entries".format(option))
+        benchmark.set_context(tier=option)
+        graph = load_graph(path)
+        print("Graph loaded in {:.2f} ms, {} edges, {} parts on cycles".format(
+            graph["load_ms"], len(graph["targets"]), graph["on_cycles"]))
+        verify(path, "Q7")
+        verify(path, "Q8")
+        for name in QUERIES:
+            avg_time(path, name)
+        print("Size of database {}".format(os.stat(
+            connection_pool.exact_path(path)).st_size))
+        print("\n")
+
+
+def avg_time(path, name) -> None:
+    print("{}:".format(name))
+    benchmark.set_context(query=name)
+    result = benchmark.run_benchmark(QUERIES[name], path)
+    benchmark.print_result(result)
+
+
+def explode_sql(path, query, num) -> Dict[str, int]:
+    rows = query_executor.fetch_read(path, query, {"num": num})
+    count, depth, price, cycle = rows[0]
+    if depth is None:
+        # num is not in Parts
+        return {"dependencies": 0, "depth": 0, "price": 0, "cycle": 0}
+    return {"dependencies": count, "depth": depth, "price": price,
+            "cycle": cycle}
+
+
+def load_graph(path) -> dict:
+    # Loads Parts once into CSR (compressed sparse row) arrays: the parts
+    # part i needs are targets[offsets[i]:offsets[i + 1]], and the parts
+    # that need part i are users[user_offsets[i]:user_offsets[i + 1]].
+    key = connection_pool.exact_path(path)
+    identity = key_sampler.file_identity(key)
+    if key in graphs and graphs[key]["identity"] == identity:
+        return graphs[key]
+    t_start = time.perf_counter()
+    rows = query_executor.fetch_read(
+        path,
+        '''
+        select
+            partNumber, partPrice, needsPart
+        from
+            Parts
+        order by
+            partNumber;
+        '''
+    )
+    numbers = array('q', (row[0] for row in rows))
+    prices = array('q', (row[1] for row in rows))
+    offsets = array('q', [0])
+    targets = array('q')
+    for row in rows:
+        i = find(numbers, row[2])
+        if i is not None:
+            targets.append(i)
+        offsets.append(len(targets))
+
+    # the same edges reversed, grouped by the part that is needed
+    counts = array('q', bytes(8 * (len(numbers) + 1)))
+    for target in targets:
+        counts[target + 1] += 1
+    user_offsets = array('q', counts)
+    for i in range(0, len(numbers)):
+        user_offsets[i + 1] += user_offsets[i]
+    users = array('q', bytes(8 * len(targets)))
+    fill = array('q', user_offsets)
+    for i in range(0, len(numbers)):
+        for target in targets[offsets[i]:offsets[i + 1]]:
+            users[fill[target]] = i
+            fill[target] += 1
+
+    graph = {"numbers": numbers, "prices": prices, "offsets": offsets,
+             "targets": targets, "user_offsets": user_offsets,
+             "users": users, "identity": identity}
+    graph["on_cycles"] = count_on_cycles(graph)
+    graph["load_ms"] = (time.perf_counter() - t_start) * 1000
+    graphs[key] = graph
+    return graph
+
+
+def find(numbers, num):
+    # Position of num in the sorted partNumbers, or None.
+    if num is None:
+        return None
+    i = bisect.bisect_left(numbers, num)
+    if i < len(numbers) and numbers[i] == num:
+        return i
+    return None
+
+
+def count_on_cycles(graph) -> int:
+    # Colours every part with an iterative depth-first search: 0 unseen,
+    # 1 on the current path, 2 done. An edge to a part on the current path
+    # closes a cycle, whose parts are then counted.
+    offsets, targets = graph["offsets"], graph["targets"]
+    colour = bytearray(len(graph["numbers"]))
+    on_cycles = 0
+    for start in range(0, len(colour)):
+        if colour[start]:
+            continue
+        stack = [(start, offsets[start])]
+        colour[start] = 1
+        while stack:
+            node, edge = stack[-1]
+            if edge == offsets[node + 1]:
+                colour[node] = 2
+                stack.pop()
+                continue
+            stack[-1] = (node, edge + 1)
+            target = targets[edge]
+            if colour[target] == 1:
+                path = [entry[0] for entry in stack]
+                on_cycles += len(path) - path.index(target)
+            elif colour[target] == 0:
+                colour[target] = 1
+                stack.append((target, offsets[target]))
+    return on_cycles
+
+
+def explode_csr(path, num, down) -> Dict[str, int]:
+    # Q7 (down) or Q8 (up) on the loaded graph. Each part is counted once;
+    # cycle is 1 when the search reached a part already visited.
+    graph = load_graph(path)
+    start = find(graph["numbers"], num)
+    if start is None:
+        return {"dependencies": 0, "depth": 0, "price": 0, "cycle": 0}
+    if down:
+        offsets, targets = graph["offsets"], graph["targets"]
+    else:
+        offsets, targets = graph["user_offsets"], graph["users"]
+    prices = graph["prices"]
+    seen = {start}
+    price = prices[start]
+    depth = 0
+    cycle = 0
+    level = [start]
+    while level:
+        following = []
+        for node in level:
+            for target in targets[offsets[node]:offsets[node + 1]]:
+                if target in seen:
+                    cycle = 1
+                    continue
+                seen.add(target)
+                price += prices[target]
+                following.append(target)
+        if following:
+            depth += 1
+        level = following
+    return {"dependencies": len(seen) - 1, "depth": depth, "price": price,
+            "cycle": cycle}
+
+
+def verify(path, name) -> bool:
+    # Checks the CSR answers against the recursive CTE for a few parts.
+    query = QUERY_7 if name == "Q7" else QUERY_8
+    matched = True
+    for num in key_sampler.sample(path, "partNumber")[:VERIFY_KEYS]:
+        expected = explode_sql(path, query, num)
+        answer = explode_csr(path, num, name == "Q7")
+        if expected != answer:
+            print("CSR {} differs from SQLite for {}: {} != {}".format(
+                name, num, answer, expected))
+            matched = False
+    return matched
+
+
+def counters(answer) -> Dict[str, int]:
+    # one row of four integers, like the CTE's result
+    return {"rows": 1, "bytes": 32, "dependencies": answer["dependencies"],
+            "depth": answer["depth"]}
+
+
+def run_query_sql(path, query) -> Dict[str, int]:
+    num = workload.next_key(path, "partNumber")
+    return counters(explode_sql(path, query, num))
+
+
+def run_query_csr(path, down) -> Dict[str, int]:
+    num = workload.next_key(path, "partNumber")
+    return counters(explode_csr(path, num, down))
+
+
+# timed function for each query, used by parallel_runner.py
+QUERIES = {"Q7": lambda path: run_query_sql(path, QUERY_7),
+           "Q7csr": lambda path: run_query_csr(path, True),
+           "Q8": lambda path: run_query_sql(path, QUERY_8),
+           "Q8csr": lambda path: run_query_csr(path, False)}
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+import argparse
+import json
+import os
+import random
+from typing import Dict, Iterable, List
+
+import A4P1
+import benchmark
+import connection_pool
+import key_sampler
+import phases
+import query_executor
+import tiers
+
+# How lookup() sends its keys to SQLite: "in" binds chunks of IN_CHUNK keys
+# as an IN (...) list, "temp" loads them into a temp table and joins it,
+# "json" passes them all as one JSON array read with json_each (the
+# sqlite3 module has no carray, so JSON stands in for it).
+STRATEGY = os.environ.get("BENCH_LOOKUP", "json")
+
+STRATEGIES = ["in", "temp", "json"]
+
+# Keys per IN (...) list; below the 999 bound variables older SQLite allow.
+IN_CHUNK = 500
+
+# the key column of Q1 and Q2
+COLUMNS = {"Q1": "partNumber", "Q2": "needsPart"}
+
+IN_QUERY = '''
+        select
+            {column}, partPrice
+        from
+            Parts
+        where
+            {column} in ({marks});
+    '''
+
+JSON_QUERY = '''
+        select
+            {column}, partPrice
+        from
+            Parts
+        where
+            {column} in (select value from json_each(:keys));
+    '''
+
+CREATE_KEYS_QUERY = '''
+        CREATE TEMP TABLE IF NOT EXISTS LookupKeys (
+            key INTEGER PRIMARY KEY
+        );
+    '''
+
+TEMP_QUERY = '''
+        select
+            p.{column}, p.partPrice
+        from
+            temp.LookupKeys k
+            join Parts p on p.{column} = k.key;
+    '''
+
+# keys timed one at a time for the single-key baseline
+SINGLE_KEYS = 1000
+
+
+def lookup_in(path, column, keys) -> List[tuple]:
+    rows = []
+    with connection_pool.connection(path, read_only=True) as connection:
+        for start in range(0, len(keys), IN_CHUNK):
+            chunk = keys[start:start + IN_CHUNK]
+            query = IN_QUERY.format(column=column,
+                                    marks=", ".join("?" * len(chunk)))
+            # the statement cache holds one statement per chunk length
+            query_executor.track_statement(connection, query)
+            rows.extend(connection.execute(query, chunk))
+    return rows
+
+
+def lookup_temp(path, column, keys) -> List[tuple]:
+    # PRAGMA query_only blocks temp tables too, so this one runs on the
+    # read-write connection.
+    with connection_pool.connection(path) as connection:
+        connection.execute(CREATE_KEYS_QUERY)
+        connection.execute('DELETE FROM temp.LookupKeys;')
+        connection.executemany('INSERT INTO temp.LookupKeys VALUES(?);',
+                               ((key,) for key in keys))
+        rows = connection.execute(TEMP_QUERY.format(column=column)).fetchall()
+        with phases.phase("commit"):
+            connection.commit()
+    return rows
+
+
+def lookup_json(path, column, keys) -> List[tuple]:
+    return query_executor.fetch_read(path, JSON_QUERY.format(column=column),
+                                     {"keys": json.dumps(keys)})
+
+
+LOOKUPS = {"in": lookup_in, "temp": lookup_temp, "json": lookup_json}
+
+
+def lookup(path, column, keys: Iterable[int],
+           strategy=None) -> Dict[int, List[int]]:
+    # Returns the prices of the parts whose column (partNumber for Q1,
+    # needsPart for Q2) equals each key. Keys with no part are left out.
+    strategy = STRATEGY if strategy is None else strategy
+    if strategy not in LOOKUPS:
+        raise ValueError("Unknown lookup strategy {}".format(strategy))
+    prices: Dict[int, List[int]] = {}
+    for key, price in LOOKUPS[strategy](path, column,
+                                        list(dict.fromkeys(keys))):
+        prices.setdefault(key, []).append(price)
+    return prices
+
+
+def get_prices_by_part_number(path, keys, strategy=None) -> Dict[int, int]:
+    # Q1 for many keys: partNumber -> partPrice.
+    return {key: prices[0] for key, prices in
+            lookup(path, "partNumber", keys, strategy).items()}
+
+
+def get_prices_by_needs_part(path, keys,
+                             strategy=None) -> Dict[int, List[int]]:
+    # Q2 for many keys: needsPart -> partPrice of every part needing it.
+    return lookup(path, "needsPart", keys, strategy)
+
+
+def draw_keys(path, name, batch_size) -> List[int]:
+    # Keys of batch_size distinct rows, or of every row on smaller tiers.
+    # Rows can share a needsPart, so Q2 keys repeat.
+    keys = list(key_sampler.sample(path, COLUMNS[name], batch_size))
+    random.shuffle(keys)
+    return keys
+
+
+def run_single(path, name, keys) -> Dict[str, int]:
+    query = A4P1.QUERY_1 if name == "Q1" else A4P1.QUERY_2
+    rows = 0
+    for key in keys:
+        rows += query_executor.execute_read(path, query, {"num": key})["rows"]
+    return {"rows": rows}
+
+
+def run_batch(path, name, keys, strategy) -> Dict[str, int]:
+    prices = lookup(path, COLUMNS[name], keys, strategy)
+    return {"rows": sum(len(found) for found in prices.values())}
+
+
+def measure(tier, name, batch_sizes, strategies, iterations) -> None:
+    path = tiers.TIERS[tier]
+    benchmark.set_context(tier=tier, query=name)
+
+    # each key once, so its per key time compares with the batches' per
+    # distinct key time
+    keys = list(dict.fromkeys(draw_keys(path, name, SINGLE_KEYS)))
+    benchmark.set_context(strategy="single", batch_size=1)
+    result = benchmark.run_benchmark(run_single, path, name, keys,
+                                     iterations=iterations, warmup=1)
+    single_us = result["wall_mean_ms"] * 1000 / len(keys)
+    result["distinct_keys"] = len(keys)
+    result["per_key_us"] = single_us
+    print("{} {} single key: {:.2f} us/key".format(tier, name, single_us))
+
+    for batch_size in batch_sizes:
+        keys = draw_keys(path, name, batch_size)
+        # lookup() sends each key once, so the cost is per distinct key
+        distinct = len(set(keys))
+        for strategy in strategies:
+            benchmark.set_context(strategy=strategy, batch_size=len(keys))
+            result = benchmark.run_benchmark(run_batch, path, name, keys,
+                                             strategy, iterations=iterations,
+                                             warmup=1)
+            result["distinct_keys"] = distinct
+            result["per_key_us"] = result["wall_mean_ms"] * 1000 / distinct
+            print("{} {} batch {:>7} {:<5}: {:.2f} us/key (x{:.1f})".format(
+                tier, name, len(keys), strategy, result["per_key_us"],
+                single_us / result["per_key_us"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare batched Q1/Q2 lookups with one query per key.")
+    parser.add_argument("--tiers", nargs="+", default=["10K", "100K"],
+                        choices=list(tiers.TIERS))
+    parser.add_argument("--queries", nargs="+", default=list(COLUMNS),
+                        choices=list(COLUMNS))
+    parser.add_argument("--batch-sizes", nargs="+", type=int,
+                        default=[1000, 10000, 100000])
+    parser.add_argument("--strategies", nargs="+", default=STRATEGIES,
+                        choices=STRATEGIES)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--index", action="store_true",
+                        help="create idxNeedsPart first, as A4P1 does")
+    parser.add_argument("--output", default=benchmark.OUTPUT)
+    args = parser.parse_args()
+
+    benchmark.set_context(application="batch",
+                          index="on" if args.index else "off")
+    for tier in args.tiers:
+        options = {tier: tiers.TIERS[tier]}
+        tiers.update_indexes(options, A4P1.DROP_INDEX_QUERY_IF_EXISTS)
+        if args.index:
+            tiers.update_indexes(options, A4P1.CREATE_INDEX_QUERY)
+        for name in args.queries:
+            measure(tier, name, args.batch_sizes, args.strategies,
+                    args.iterations)
+        if args.index:
+            tiers.update_indexes(options, A4P1.DROP_INDEX_QUERY)
+    connection_pool.close_all()
+    benchmark.write_results(args.output)
+
+
+if __name__ == "__main__":
+    main()
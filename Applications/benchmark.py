@@ -0,0 +1,196 @@
+import csv
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional
+
+import connection_pool
+import key_sampler
+import phases
+import query_executor
+import query_plan
+import results_store
+import tuning
+
+# Untimed runs made before measuring, so caches and key lists are loaded.
+WARMUP = int(os.environ.get("BENCH_WARMUP", 5))
+
+# Timed runs per measurement.
+ITERATIONS = int(os.environ.get("BENCH_ITERATIONS", 100))
+
+# File the results are written to by write_results(), as JSON or CSV
+# depending on its extension. Nothing is written when it is not set.
+OUTPUT = os.environ.get("BENCH_OUTPUT")
+
+PERCENTILES = (50, 95, 99)
+
+# labels (application, query, tier, index, ...) added to every result
+context: Dict[str, str] = {}
+
+# every result measured so far
+results: List[dict] = []
+
+
+def set_context(**labels) -> None:
+    # Labels the results measured from now on.
+    context.update(labels)
+
+
+def percentile(samples, pct) -> float:
+    # Nearest-rank percentile of already sorted samples.
+    rank = max(0, -(-pct * len(samples) // 100) - 1)
+    return samples[min(rank, len(samples) - 1)]
+
+
+def summarize(name, samples_ns) -> dict:
+    # Returns mean, percentiles and max of the samples in ms.
+    ordered = sorted(samples_ns)
+    summary = {name + "_mean_ms": sum(ordered) / len(ordered) / 1e6}
+    for pct in PERCENTILES:
+        summary["{}_p{}_ms".format(name, pct)] = percentile(ordered, pct) / 1e6
+    summary[name + "_max_ms"] = ordered[-1] / 1e6
+    return summary
+
+
+def start_cold(path) -> None:
+    # Makes the next run start cold: the pooled connections are closed,
+    # taking SQLite's page caches and memory maps with them, and the OS
+    # drops its cached pages of the file.
+    connection_pool.close_all()
+    tuning.drop_os_cache(connection_pool.exact_path(path))
+
+
+def run_benchmark(fn, *args, iterations=None, warmup=None) -> dict:
+    # Times fn(*args) and returns the wall and CPU time distribution.
+    iterations = ITERATIONS if iterations is None else iterations
+    warmup = WARMUP if warmup is None else warmup
+    # the key samples are checked against their files here instead of on
+    # every draw
+    key_sampler.check()
+    # one extra untimed run records the plan and statement counters, so
+    # the timed runs pay nothing for them
+    plan = {}
+    if query_plan.CAPTURE:
+        query_plan.start()
+        try:
+            fn(*args)
+        finally:
+            plan = query_plan.stop()
+    for i in range(0, warmup):
+        fn(*args)
+
+    wall_ns = []
+    cpu_ns = []
+    # counters (rows, bytes, ...) returned by fn, summed over the runs
+    counters: Dict[str, int] = {}
+    phases.start()
+    try:
+        for i in range(0, iterations):
+            # every caller passes the database path first
+            if tuning.STATE == "cold":
+                start_cold(args[0])
+            c_start = time.process_time_ns()
+            t_start = time.perf_counter_ns()
+            returned = fn(*args)
+            t_taken = time.perf_counter_ns() - t_start
+            c_taken = time.process_time_ns() - c_start
+            wall_ns.append(t_taken)
+            cpu_ns.append(c_taken)
+            if isinstance(returned, dict):
+                for name, value in returned.items():
+                    counters[name] = counters.get(name, 0) + value
+    finally:
+        measured = phases.stop(iterations, sum(wall_ns))
+
+    result = dict(context)
+    result["iterations"] = iterations
+    result["warmup"] = warmup
+    result.update(summarize("wall", wall_ns))
+    result.update(summarize("cpu", cpu_ns))
+    for name, value in counters.items():
+        result[name + "_per_run"] = value / iterations
+    result.update(plan)
+    result.update(measured)
+    result["wall_samples_ns"] = wall_ns
+    results.append(result)
+    return result
+
+
+def run_within(fn, *args, budget=None) -> Optional[dict]:
+    # Like run_benchmark(), but SQLite aborts any statement of fn that runs
+    # for more than budget seconds, and the iterations are cut so the timed
+    # runs take about budget seconds in all. Returns None when a single run
+    # does not fit in the budget.
+    if budget is None:
+        return run_benchmark(fn, *args)
+    query_executor.TIME_LIMIT = budget
+    try:
+        t_start = time.perf_counter()
+        fn(*args)
+        first = time.perf_counter() - t_start
+        iterations = ITERATIONS
+        if first * ITERATIONS > budget:
+            iterations = max(1, int(budget / first))
+        return run_benchmark(fn, *args, iterations=iterations,
+                             warmup=min(WARMUP, iterations))
+    except sqlite3.OperationalError as error:
+        if "interrupted" not in str(error):
+            raise
+        return None
+    finally:
+        query_executor.TIME_LIMIT = None
+
+
+def print_result(result) -> None:
+    # display in ms
+    print("Avg time: {} ms".format(result["wall_mean_ms"]))
+    print("p50: {:.4f} ms, p95: {:.4f} ms, p99: {:.4f} ms, max: {:.4f} ms".format(
+        result["wall_p50_ms"], result["wall_p95_ms"],
+        result["wall_p99_ms"], result["wall_max_ms"]))
+    print("CPU avg: {:.4f} ms, CPU p99: {:.4f} ms".format(
+        result["cpu_mean_ms"], result["cpu_p99_ms"]))
+    if "rows_per_run" in result:
+        print("Rows per run: {}, bytes per run: {}".format(
+            result["rows_per_run"], result["bytes_per_run"]))
+    if "plan" in result:
+        print("Plan: {}".format(result["plan"]))
+    phases.print_phases(result)
+    if "vm_steps" in result:
+        print("Full scan steps: {}, sorts: {}, auto indexes: {}, "
+              "VM steps: {}".format(
+                  result["fullscan_steps"], result["sorts"],
+                  result["autoindexes"], result["vm_steps"]))
+
+
+def write_results(path=None) -> None:
+    # Writes every result to path (or BENCH_OUTPUT) as JSON or CSV, and
+    # adds them as a run to the results store when BENCH_STORE is set.
+    results_store.save(results)
+    path = OUTPUT if path is None else path
+    if not path:
+        return
+    if path.endswith(".csv"):
+        write_csv(path)
+    else:
+        write_json(path)
+    print("Results written to {}".format(path))
+
+
+def write_json(path) -> None:
+    with open(path, "w") as jsonfile:
+        json.dump(results, jsonfile, indent=2)
+
+
+def write_csv(path) -> None:
+    # The raw samples are left out so each result fits on one row.
+    fields = []
+    for result in results:
+        for field in result:
+            if field not in fields and not field.endswith("_samples_ns"):
+                fields.append(field)
+    with open(path, "w", newline="") as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=fields,
+                                extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(results)
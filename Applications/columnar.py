@@ -0,0 +1,203 @@
+import os
+import random
+from typing import Dict, List
+
+import connection_pool
+import query_executor
+
+# numpy, imported by numpy() the first time something needs it, so runs
+# that never use it do not pay for the import at startup
+np = None
+
+# Which engine answers Q1-Q6: "sqlite" (default) or "columnar", which
+# keeps Parts in NumPy arrays and answers with vectorized kernels.
+BACKEND = os.environ.get("BENCH_BACKEND", "sqlite")
+
+# Keys drawn from each tier when checking the columnar answers against
+# SQLite for the queries that take a parameter.
+VERIFY_KEYS = 20
+
+# loaded Parts tables keyed by absolute database path
+tables: Dict[str, dict] = {}
+
+
+def enabled() -> bool:
+    return BACKEND == "columnar"
+
+
+def numpy():
+    # The numpy module, or None when it is not installed.
+    global np
+    if np is None:
+        try:
+            import numpy as np
+        except ImportError:
+            return None
+    return np
+
+
+def load(path) -> dict:
+    # Loads Parts from the database at path into NumPy arrays, once.
+    key = connection_pool.exact_path(path)
+    if key in tables:
+        return tables[key]
+    if numpy() is None:
+        raise ImportError("The columnar backend needs numpy installed")
+
+    rows = query_executor.fetch_read(
+        path,
+        '''
+        select
+            partNumber, partPrice, needsPart, madeIn
+        from
+            Parts
+        order by
+            partNumber;
+        '''
+    )
+    part_number = np.fromiter((row[0] for row in rows), np.int64, len(rows))
+    part_price = np.fromiter((row[1] for row in rows), np.uint8, len(rows))
+    # a NULL needsPart makes every NOT IN comparison unknown, so Q6 counts 0
+    has_needs = np.fromiter(
+        (row[2] is not None for row in rows), bool, len(rows))
+    needs_part = np.fromiter(
+        (row[2] for row in rows if row[2] is not None), np.int64)
+    countries, made_in = np.unique(
+        np.array([row[3] for row in rows]), return_inverse=True)
+    made_in = made_in.astype(np.uint8 if len(countries) < 256 else np.uint16)
+
+    # needsPart sorted, with the price of each row in the same order (Q2)
+    needs_order = np.argsort(needs_part, kind="stable")
+    # row numbers grouped by country and where each country starts (Q4)
+    country_order = np.argsort(made_in, kind="stable")
+    country_start = np.searchsorted(
+        made_in[country_order], np.arange(len(countries) + 1))
+
+    table = {
+        "part_number": part_number,
+        "part_price": part_price,
+        "needs_part": needs_part,
+        "needs_null": not has_needs.all(),
+        "made_in": made_in,
+        "countries": countries,
+        "needs_sorted": needs_part[needs_order],
+        "needs_price": part_price[has_needs][needs_order],
+        "country_order": country_order,
+        "country_start": country_start,
+    }
+    tables[key] = table
+    return table
+
+
+def query_1(table, num):
+    # Price of the part with partNumber = num, by binary search.
+    part_number = table["part_number"]
+    i = np.searchsorted(part_number, int(num))
+    if i < len(part_number) and part_number[i] == int(num):
+        return table["part_price"][i:i + 1]
+    return table["part_price"][0:0]
+
+
+def query_2(table, num):
+    # Prices of the parts with needsPart = num.
+    needs_sorted = table["needs_sorted"]
+    lo = np.searchsorted(needs_sorted, int(num), side="left")
+    hi = np.searchsorted(needs_sorted, int(num), side="right")
+    return table["needs_price"][lo:hi]
+
+
+def query_3(table):
+    # Average price per country, in madeIn order like the group by.
+    made_in = table["made_in"]
+    totals = np.bincount(made_in, weights=table["part_price"])
+    counts = np.bincount(made_in)
+    return totals / counts
+
+
+def query_4(table, country_code):
+    # partNumber of the most expensive part made in country_code.
+    countries = table["countries"]
+    code = np.searchsorted(countries, country_code)
+    if code == len(countries) or countries[code] != country_code:
+        return table["part_number"][0:0]
+    start = table["country_start"][code]
+    end = table["country_start"][code + 1]
+    rows = table["country_order"][start:end]
+    best = rows[np.argmax(table["part_price"][rows])]
+    return table["part_number"][best:best + 1]
+
+
+def query_5(table) -> int:
+    # Parts that no part needs, as a hash-style membership test.
+    not_needed = np.isin(table["part_number"], table["needs_part"],
+                         invert=True)
+    return int(np.count_nonzero(not_needed))
+
+
+def query_6(table) -> int:
+    # Parts that no part needs, as a sorted set difference.
+    if table["needs_null"]:
+        return 0
+    return int(np.setdiff1d(table["part_number"], table["needs_part"]).size)
+
+
+KERNELS = {
+    "Q1": query_1,
+    "Q2": query_2,
+    "Q3": query_3,
+    "Q4": query_4,
+    "Q5": query_5,
+    "Q6": query_6,
+}
+
+
+def execute(path, name, *params) -> Dict[str, int]:
+    # Answers query name (Q1-Q6) for the database at path and reports the
+    # rows and bytes produced, like query_executor.execute_read().
+    answer = KERNELS[name](load(path), *params)
+    if isinstance(answer, int):
+        return {"rows": 1, "bytes": 8}
+    return {"rows": len(answer), "bytes": answer.nbytes}
+
+
+def sample_params(table, name) -> List[tuple]:
+    # Keys to check the parameterized queries with.
+    if name == "Q1":
+        column = table["part_number"]
+    elif name == "Q2":
+        column = table["needs_part"]
+    elif name == "Q4":
+        column = table["countries"]
+    else:
+        return [()]
+    picks = random.sample(range(len(column)), min(VERIFY_KEYS, len(column)))
+    return [(column[i].item(),) for i in picks]
+
+
+def verify(path, name, query, param_name=None) -> bool:
+    # Checks the columnar answers for query name against SQLite on the
+    # database at path and prints any mismatch.
+    table = load(path)
+    matched = True
+    for params in sample_params(table, name):
+        bound = {param_name: params[0]} if param_name else {}
+        expected = query_executor.fetch_read(path, query, bound)
+        answer = KERNELS[name](table, *params)
+        if name == "Q3":
+            same = np.allclose(answer, [row[0] for row in expected])
+        elif name == "Q4":
+            # ties on the max price may pick a different part, so compare
+            # the prices of the parts chosen
+            same = (len(answer) == len(expected) and all(
+                query_1(table, a).tolist() == query_1(table, e[0]).tolist()
+                for a, e in zip(answer.tolist(), expected)))
+        elif name in ("Q5", "Q6"):
+            same = answer == expected[0][0]
+        else:
+            same = sorted(answer.tolist()) == sorted(
+                row[0] for row in expected)
+        if not same:
+            print("Columnar {} differs from SQLite for {} on {}".format(
+                name, params, path))
+            matched = False
+    return matched
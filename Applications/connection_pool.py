@@ -0,0 +1,154 @@
+import os
+import sqlite3
+import urllib.parse
+from collections import OrderedDict
+from contextlib import contextmanager
+from sqlite3 import Connection
+from typing import Dict, Iterator, List, Tuple
+
+import layouts
+import phases
+import tuning
+
+# Number of idle connections kept open for a database file unless
+# set_pool_size() was called for it.
+DEFAULT_POOL_SIZE = 1
+
+# Number of compiled statements sqlite3 keeps for each connection.
+STATEMENT_CACHE_SIZE = 128
+
+# idle connections for each database file, keyed by absolute path and
+# whether the connections are read-only
+pools: Dict[Tuple[str, bool], List[Connection]] = {}
+
+# pool size overrides for each database file, keyed by absolute path
+pool_sizes: Dict[str, int] = {}
+
+# connections opened, handed out again from the pool and closed
+stats = {"opened": 0, "reused": 0, "closed": 0}
+
+
+class PooledConnection(Connection):
+    # sqlite3 connection that remembers which statements it has compiled,
+    # in the same least-recently-used order as the sqlite3 statement cache.
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements = OrderedDict()
+        # last PRAGMA data_version seen by result_cache.py
+        self.data_version = None
+
+
+def exact_path(path, layout=None) -> str:
+    # Used to convert relative path to absolute path, pointing at the copy
+    # of the tier in layout (layouts.LAYOUT unless given).
+    curr = os.path.dirname(__file__)
+    load_path = os.path.abspath(os.path.join(curr, path))
+    return layouts.file_path(load_path, layout)
+
+
+def set_pool_size(path, size) -> None:
+    # Sets how many idle connections are kept open for the database at path.
+    key = exact_path(path)
+    pool_sizes[key] = size
+    for read_only in (False, True):
+        idle = pools.get((key, read_only), [])
+        while len(idle) > size:
+            idle.pop().close()
+            stats["closed"] += 1
+
+
+def open_connection(path, read_only=False) -> Connection:
+    # Returns a new connection to the database provided at the path.
+    if layouts.LAYOUT != "rowid" and not os.path.exists(path):
+        # a read-write connection would create an empty file instead
+        raise FileNotFoundError(
+            "No {} layout at {}, build it with DBINIT_LAYOUTS".format(
+                layouts.LAYOUT, path))
+    if tuning.preloads():
+        # Every connection shares the in-memory copy, so indexes created
+        # for a run change the copy and never the file.
+        connection = sqlite3.connect(
+            tuning.memory_uri(path), uri=True,
+            cached_statements=STATEMENT_CACHE_SIZE, factory=PooledConnection)
+        tuning.apply(connection)
+        phases.watch(connection)
+        if read_only:
+            connection.execute(' PRAGMA query_only=ON; ')
+        stats["opened"] += 1
+        return connection
+    if read_only:
+        # mode=ro fails instead of creating a missing database file and
+        # query_only rejects any statement that would write.
+        uri = "file:{}?mode=ro".format(urllib.parse.quote(path))
+        connection = sqlite3.connect(
+            uri, uri=True, cached_statements=STATEMENT_CACHE_SIZE,
+            factory=PooledConnection)
+        tuning.apply(connection)
+        phases.watch(connection)
+        connection.execute(' PRAGMA query_only=ON; ')
+        stats["opened"] += 1
+        return connection
+    connection = sqlite3.connect(
+        path, cached_statements=STATEMENT_CACHE_SIZE,
+        factory=PooledConnection)
+    tuning.apply(connection)
+    phases.watch(connection)
+    cursor = connection.cursor()
+    # To enable foreign keys for SQLite
+    cursor.execute(' PRAGMA foreign_keys=ON; ')
+    connection.commit()
+    stats["opened"] += 1
+    return connection
+
+
+def acquire(path, read_only=False) -> Connection:
+    # Returns an idle connection for the database at path, opening one if
+    # the pool for that database is empty.
+    key = exact_path(path)
+    idle = pools.setdefault((key, read_only), [])
+    if idle:
+        stats["reused"] += 1
+        return idle.pop()
+    return open_connection(key, read_only)
+
+
+def release(path, connection, read_only=False) -> None:
+    # Hands the connection back to the pool, or closes it if the pool for
+    # that database is already full.
+    key = exact_path(path)
+    idle = pools.setdefault((key, read_only), [])
+    if len(idle) < pool_sizes.get(key, DEFAULT_POOL_SIZE):
+        idle.append(connection)
+    else:
+        connection.close()
+        stats["closed"] += 1
+
+
+@contextmanager
+def connection(path, read_only=False) -> Iterator[Connection]:
+    # Borrows a pooled connection for the duration of a with block.
+    with phases.phase("connect"):
+        conn = acquire(path, read_only)
+    try:
+        yield conn
+    finally:
+        with phases.phase("close"):
+            release(path, conn, read_only)
+
+
+def close_all() -> None:
+    # Closes every idle connection held by the pool.
+    for idle in pools.values():
+        while idle:
+            idle.pop().close()
+            stats["closed"] += 1
+
+
+def reset_stats() -> None:
+    for name in stats:
+        stats[name] = 0
+
+
+def print_stats() -> None:
+    print("Connections opened: {}, reused: {}, closed: {}".format(
+        stats["opened"], stats["reused"], stats["closed"]))
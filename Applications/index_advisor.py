@@ -0,0 +1,328 @@
+import argparse
+import json
+import re
+import sqlite3
+import time
+from typing import Dict, List
+
+import A4P1
+import A4P2
+import A4P3
+import A4P4
+import benchmark
+import columnar
+import connection_pool
+import key_sampler
+import query_executor
+import query_plan
+import summary
+import tiers
+
+APPLICATIONS = [A4P1, A4P2, A4P3, A4P4]
+
+# query text of each workload query, parsed for candidate indexes
+WORKLOAD = {
+    "Q1": A4P1.QUERY_1,
+    "Q2": A4P1.QUERY_2,
+    "Q3": A4P2.QUERY_3,
+    "Q4": A4P3.QUERY_4,
+    "Q5": A4P4.QUERY_5,
+    "Q6": A4P4.QUERY_6,
+}
+
+# timed function of each workload query
+TIMED = dict(A4P1.QUERIES, **A4P2.QUERIES, **A4P3.QUERIES, **A4P4.QUERIES)
+
+# Timed runs per query and candidate; kept low since every candidate is
+# measured on every tier.
+ITERATIONS = 20
+
+# Seconds a single run of a query may take. Slower queries are stopped
+# and recorded at the budget, as a lower bound of their real time.
+TIME_BUDGET = 2.0
+
+# Rows inserted (and rolled back) to measure the write cost of an index.
+WRITE_ROWS = 1000
+
+# A query only counts as sped up by an index when its time drops by more
+# than this share, so run-to-run noise is not mistaken for a win.
+MIN_IMPROVEMENT = 0.1
+
+COLUMNS = ["partNumber", "partPrice", "needsPart", "madeIn"]
+
+
+def referenced(sql) -> List[str]:
+    return [c for c in COLUMNS if re.search(r"\b{}\b".format(c), sql, re.I)]
+
+
+def parse_query(sql) -> dict:
+    # Finds the columns each part of a workload query filters, groups,
+    # aggregates or probes on.
+    # column = :param or column = alias.column; a comparison with a
+    # subquery result is left to the aggregate that computes it
+    equality = []
+    for column in COLUMNS:
+        if re.search(r"\b{}\s*=\s*(:\w+|\w+\.\w+)".format(column),
+                     sql, re.I) or re.search(
+                r"=\s*\w+\.{}\b".format(column), sql, re.I):
+            equality.append(column)
+    group = re.findall(r"group\s+by\s+(\w+)", sql, re.I)
+    aggregated = re.findall(r"(?:avg|max|min|sum)\s*\(\s*(\w+)\s*\)",
+                            sql, re.I)
+    maximized = re.findall(r"max\s*\(\s*(\w+)\s*\)", sql, re.I)
+    probed = re.findall(r"not\s+in\s*\(\s*select\s+(\w+)", sql, re.I)
+    return {"equality": equality, "group": group, "aggregated": aggregated,
+            "maximized": maximized, "probed": probed,
+            "referenced": referenced(sql)}
+
+
+def candidate(columns, where=None) -> dict:
+    definition = ", ".join(columns)
+    name = "adv_" + "_".join(re.sub(r"\W", "", c) for c in columns)
+    if where:
+        name += "_partial"
+    return {"name": name, "columns": definition, "where": where}
+
+
+def candidates_for(sql) -> List[dict]:
+    parsed = parse_query(sql)
+    found = []
+    keys = [c for c in parsed["equality"] + parsed["group"] + parsed["probed"]
+            if c != "partNumber"]
+    for key in dict.fromkeys(keys):
+        found.append(candidate([key]))
+        # an equality on key implies key IS NOT NULL, so a partial index
+        # on the non-null rows can answer it
+        found.append(candidate([key], "{} IS NOT NULL".format(key)))
+        others = [c for c in parsed["aggregated"] if c != key]
+        if others:
+            found.append(candidate([key] + others))
+        for column in parsed["maximized"]:
+            covering = [key, column + " DESC"] + [
+                c for c in parsed["referenced"] if c not in (key, column)]
+            found.append(candidate(covering))
+        covering = [key] + [c for c in parsed["referenced"] if c != key]
+        found.append(candidate(covering))
+    return found
+
+
+def app_candidates() -> List[dict]:
+    # The indexes the applications create, so they are scored too.
+    found = []
+    for app in APPLICATIONS:
+        match = re.search(r"ON\s+Parts\s*\(([^)]*)\)", app.CREATE_INDEX_QUERY,
+                          re.I)
+        spelling = {c.lower(): c for c in COLUMNS}
+        columns = [spelling.get(c.strip().lower(), c.strip())
+                   for c in match.group(1).split(",")]
+        found.append(candidate(columns))
+    return found
+
+
+def all_candidates() -> List[dict]:
+    unique = {}
+    for sql in WORKLOAD.values():
+        for found in candidates_for(sql):
+            unique.setdefault((found["columns"], found["where"]), found)
+    for found in app_candidates():
+        unique.setdefault((found["columns"], found["where"]), found)
+    return list(unique.values())
+
+
+def used_pages(connection) -> int:
+    page_count = connection.execute(' PRAGMA page_count; ').fetchone()[0]
+    free = connection.execute(' PRAGMA freelist_count; ').fetchone()[0]
+    return page_count - free
+
+
+def create_candidate(path, found) -> dict:
+    # Creates the index and returns its build time and size.
+    query = "CREATE INDEX {} ON Parts ({})".format(
+        found["name"], found["columns"])
+    if found["where"]:
+        query += " WHERE {}".format(found["where"])
+    with connection_pool.connection(path) as connection:
+        page_size = connection.execute(' PRAGMA page_size; ').fetchone()[0]
+        before = used_pages(connection)
+        t_start = time.perf_counter()
+        connection.execute(query)
+        connection.commit()
+        build_ms = (time.perf_counter() - t_start) * 1000
+        size = (used_pages(connection) - before) * page_size
+    return {"build_ms": build_ms, "size_bytes": size}
+
+
+def drop_candidate(path, found) -> None:
+    with connection_pool.connection(path) as connection:
+        connection.execute("DROP INDEX IF EXISTS {}".format(found["name"]))
+        connection.commit()
+
+
+def explain_uses(path, name, index_name) -> bool:
+    # Whether SQLite picks index_name for workload query name.
+    sql = WORKLOAD[name]
+    params = {}
+    if ":num" in sql:
+        column = "partNumber" if name == "Q1" else "needsPart"
+        params = {"num": key_sampler.choice(path, column)}
+    elif ":countrycode" in sql:
+        params = {"countrycode": key_sampler.choice(path, "madeIn")}
+    with connection_pool.connection(path) as connection:
+        plan = connection.execute("EXPLAIN QUERY PLAN " + sql,
+                                  params).fetchall()
+    return any(index_name in row[-1] for row in plan)
+
+
+def time_query(path, name) -> float:
+    # Mean wall time of workload query name in ms.
+    query_executor.TIME_LIMIT = TIME_BUDGET
+    try:
+        t_start = time.perf_counter()
+        TIMED[name](path)
+        first = time.perf_counter() - t_start
+        if first * ITERATIONS > TIME_BUDGET:
+            return first * 1000
+        result = benchmark.run_benchmark(TIMED[name], path,
+                                         iterations=ITERATIONS, warmup=1)
+        return result["wall_mean_ms"]
+    except sqlite3.OperationalError as error:
+        if "interrupted" not in str(error):
+            raise
+        return TIME_BUDGET * 1000
+    finally:
+        query_executor.TIME_LIMIT = None
+
+
+def time_writes(path) -> float:
+    # Cost of inserting one row in ms, measured on WRITE_ROWS fresh rows
+    # that are rolled back afterwards.
+    with connection_pool.connection(path) as connection:
+        top = connection.execute(
+            "select max(partNumber), max(needsPart) from Parts").fetchone()
+        start = max(top[0] or 0, top[1] or 0) + 1
+        rows = [(start + i, i % 101, start + i, "ZZ")
+                for i in range(0, WRITE_ROWS)]
+        t_start = time.perf_counter()
+        connection.executemany(
+            "INSERT INTO Parts VALUES(?, ?, ?, ?)", rows)
+        t_taken = time.perf_counter() - t_start
+        connection.rollback()
+    return t_taken * 1000 / WRITE_ROWS
+
+
+def measure_tier(tier, candidates, names) -> dict:
+    path = tiers.TIERS[tier]
+    for app in APPLICATIONS:
+        tiers.update_index(path, app.DROP_INDEX_QUERY_IF_EXISTS)
+
+    print("Baseline for {} entries".format(tier))
+    with connection_pool.connection(path) as connection:
+        triggered = summary.triggered(connection)
+    if triggered:
+        summary.warn_triggered(tier)
+    baseline = {name: time_query(path, name) for name in names}
+    baseline_write = time_writes(path)
+    measured = []
+    for found in candidates:
+        built = create_candidate(path, found)
+        timings = {name: time_query(path, name) for name in names}
+        used = [name for name in names
+                if explain_uses(path, name, found["name"])]
+        write_ms = time_writes(path)
+        drop_candidate(path, found)
+        entry = dict(found, **built)
+        entry["query_ms"] = timings
+        entry["used_by"] = used
+        entry["write_overhead_ms"] = max(0.0, write_ms - baseline_write)
+        measured.append(entry)
+        print("  {:<45} build {:>9.2f} ms  size {:>9} B  used by {}".format(
+            found["name"], built["build_ms"], built["size_bytes"],
+            ",".join(used) or "-"))
+    return {"tier": tier, "summary": "on" if triggered else "off",
+            "baseline_ms": baseline,
+            "baseline_write_ms": baseline_write, "candidates": measured}
+
+
+def recommend(tier_result, read_ratio) -> List[dict]:
+    # Greedily picks the candidates whose read savings, weighted by
+    # read_ratio, outweigh their extra cost per write. A query only counts
+    # its best index, so overlapping candidates are not picked twice.
+    # Candidates were measured one at a time, so this ignores how indexes
+    # interact with each other.
+    current = dict(tier_result["baseline_ms"])
+    chosen = []
+    remaining = list(tier_result["candidates"])
+    while remaining:
+        def gain(entry) -> float:
+            saved = 0.0
+            for name in current:
+                delta = current[name] - entry["query_ms"][name]
+                if delta > MIN_IMPROVEMENT * current[name]:
+                    saved += delta
+            saved /= len(current)
+            return (read_ratio * saved
+                    - (1 - read_ratio) * entry["write_overhead_ms"])
+        best = max(remaining, key=gain)
+        if gain(best) <= 0:
+            break
+        chosen.append(best)
+        remaining.remove(best)
+        for name in current:
+            current[name] = min(current[name], best["query_ms"][name])
+    return chosen
+
+
+def print_report(tier_result, chosen, read_ratio) -> None:
+    baseline = tier_result["baseline_ms"]
+    print("\nSpeedups for {} entries (baseline ms: {})".format(
+        tier_result["tier"], ", ".join(
+            "{} {}{:.3f}".format(
+                name, ">=" if ms >= TIME_BUDGET * 1000 else "", ms)
+            for name, ms in baseline.items())))
+    for entry in tier_result["candidates"]:
+        speedups = ", ".join(
+            "{} x{:.1f}".format(name, baseline[name] / ms)
+            for name, ms in entry["query_ms"].items()
+            if ms and baseline[name] / ms >= 1.5)
+        print("  {:<45} {}".format(entry["name"], speedups or "-"))
+    print("Recommended for {:.0%} reads: {}".format(read_ratio, ", ".join(
+        "CREATE INDEX {} ON Parts ({}){}".format(
+            entry["name"], entry["columns"],
+            " WHERE " + entry["where"] if entry["where"] else "")
+        for entry in chosen) or "no index"))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Propose candidate indexes for Q1-Q6, measure each one "
+                    "on every tier and recommend a set for a read/write mix.")
+    parser.add_argument("--tiers", nargs="+", default=["100", "1K", "10K"],
+                        choices=list(tiers.TIERS))
+    parser.add_argument("--queries", nargs="+", default=list(WORKLOAD),
+                        choices=list(WORKLOAD))
+    parser.add_argument("--read-ratio", type=float, default=0.9,
+                        help="share of operations that are reads")
+    parser.add_argument("--output", help="write the measurements as JSON")
+    args = parser.parse_args()
+
+    # candidates are judged against SQLite, not the columnar engine, and
+    # their plans are checked by explain_uses()
+    columnar.BACKEND = "sqlite"
+    query_plan.CAPTURE = False
+    candidates = all_candidates()
+    print("{} candidate indexes".format(len(candidates)))
+    report: List[Dict] = []
+    for tier in args.tiers:
+        tier_result = measure_tier(tier, candidates, args.queries)
+        chosen = recommend(tier_result, args.read_ratio)
+        tier_result["recommended"] = [entry["name"] for entry in chosen]
+        print_report(tier_result, chosen, args.read_ratio)
+        report.append(tier_result)
+    connection_pool.close_all()
+    if args.output:
+        with open(args.output, "w") as jsonfile:
+            json.dump(report, jsonfile, indent=2)
+
+
+if __name__ == "__main__":
+    main()
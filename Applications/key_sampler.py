@@ -0,0 +1,164 @@
+import os
+import random
+import zlib
+from array import array
+from typing import Dict, Sequence, Tuple
+
+import connection_pool
+import layouts
+import query_executor
+
+# How keys are drawn from a column: "random" lets SQLite pick them with
+# ORDER BY random() LIMIT k, "reservoir" streams the column through a
+# reservoir sample of k keys, "hash" orders the rows by a hash of their
+# partNumber and SEED so the same keys come back in every run. None of them
+# loads the whole column.
+METHOD = os.environ.get("BENCH_KEY_SAMPLER", "random")
+
+
+def seed_value(value) -> int:
+    # The "hash" seed for value: the number itself when value is one,
+    # otherwise its CRC-32, so any BENCH_SEED or --seed string works.
+    value = str(value)
+    return int(value) if value.isdigit() else zlib.crc32(value.encode())
+
+
+# Seed of the "hash" method.
+SEED = seed_value(os.environ.get("BENCH_SEED") or 0)
+
+# Keys kept for each (database, column).
+SAMPLE_SIZE = int(os.environ.get("BENCH_KEY_SAMPLE_SIZE", 10000))
+
+# columns keys can be drawn from; the integer ones are stored in array('q')
+COLUMNS = {"partNumber": True, "needsPart": True, "madeIn": False}
+
+# sampled keys keyed by (path, layout, column, k, method, seed) as sample() is
+# called, with the absolute path and identity of the file they were drawn
+# from. A draw does not look at the file; check() and invalidate() do.
+samples: Dict[tuple, Tuple[str, tuple, Sequence]] = {}
+
+stats = {"loads": 0, "hits": 0}
+
+
+def file_identity(path) -> tuple:
+    # Changes when the file is replaced or written to.
+    info = os.stat(path)
+    return (info.st_dev, info.st_ino, info.st_size, info.st_mtime_ns)
+
+
+def check() -> None:
+    # Drops the samples of files replaced or written to since they were
+    # drawn. benchmark.run_benchmark() calls it once per measurement.
+    for key, (db_path, identity, keys) in list(samples.items()):
+        if (not os.path.exists(db_path) or
+                file_identity(db_path) != identity):
+            del samples[key]
+
+
+def invalidate(path) -> None:
+    # Drops every sample of the database at path.
+    db_path = connection_pool.exact_path(path)
+    for key in [key for key, entry in samples.items()
+                if entry[0] == db_path]:
+        del samples[key]
+
+
+def new_keys(column) -> Sequence:
+    return array('q') if COLUMNS[column] else []
+
+
+def sample_random(path, column, k) -> Sequence:
+    keys = new_keys(column)
+    rows = query_executor.fetch_read(
+        path,
+        '''
+        select
+            {}
+        from
+            Parts
+        order by
+            random()
+        limit :k;
+        '''.format(column),
+        {"k": k})
+    keys.extend(row[0] for row in rows)
+    return keys
+
+
+def sample_hash(path, column, k) -> Sequence:
+    # Multiplicative hashing of the partNumber modulo the prime 2**31 - 1,
+    # reduced first to keep the product within 64 bits. partNumber is the
+    # rowid in the rowid layouts and is unique in every layout, including
+    # the WITHOUT ROWID ones that have no rowid to hash.
+    keys = new_keys(column)
+    rows = query_executor.fetch_read(
+        path,
+        '''
+        select
+            {}
+        from
+            Parts
+        order by
+            ((partNumber % 2147483647) * 1000003 + :seed) % 2147483647,
+            partNumber
+        limit :k;
+        '''.format(column),
+        {"k": k, "seed": SEED})
+    keys.extend(row[0] for row in rows)
+    return keys
+
+
+def sample_reservoir(path, column, k) -> Sequence:
+    # Algorithm R over the column, read one row at a time.
+    keys = new_keys(column)
+    with connection_pool.connection(path, read_only=True) as connection:
+        cursor = connection.execute(
+            'select {} from Parts;'.format(column))
+        for i, (key,) in enumerate(cursor):
+            if i < k:
+                keys.append(key)
+            else:
+                j = random.randint(0, i)
+                if j < k:
+                    keys[j] = key
+    # the first keys are in table order; shuffle them so zipf ranks are not
+    # tied to where the rows are stored
+    random.shuffle(keys)
+    return keys
+
+
+def sample(path, column, k=None, method=None) -> Sequence:
+    # Returns up to k keys of column drawn uniformly from the rows of the
+    # database at path. They are cached until check() finds that the file
+    # changed or invalidate() drops them.
+    k = SAMPLE_SIZE if k is None else k
+    method = METHOD if method is None else method
+    # a "hash" sample depends on the seed as well
+    key = (path, layouts.LAYOUT, column, k, method,
+           SEED if method == "hash" else None)
+    cached = samples.get(key)
+    if cached is not None:
+        stats["hits"] += 1
+        return cached[2]
+
+    if column not in COLUMNS:
+        raise ValueError("Cannot sample keys from column {}".format(column))
+    db_path = connection_pool.exact_path(path)
+    identity = file_identity(db_path)
+
+    if method == "random":
+        keys = sample_random(path, column, k)
+    elif method == "reservoir":
+        keys = sample_reservoir(path, column, k)
+    elif method == "hash":
+        keys = sample_hash(path, column, k)
+    else:
+        raise ValueError("Unknown key sampling method {}".format(method))
+    samples[key] = (db_path, identity, keys)
+    stats["loads"] += 1
+    return keys
+
+
+def choice(path, column):
+    # Returns one random key of column for the database at path.
+    return random.choice(sample(path, column))
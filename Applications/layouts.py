@@ -0,0 +1,133 @@
+import os
+import sqlite3
+from typing import Dict
+
+# Which storage layout of each tier the applications read. "rowid" is the
+# tier file itself; any other layout is a copy of it in SQLiteDBs/layouts,
+# built by Setup/dbinit.py with DBINIT_LAYOUTS.
+LAYOUT = os.environ.get("BENCH_LAYOUT", "rowid")
+
+# What each part of a layout name changes from the tier file. Parts are
+# joined with "+", e.g. "norowid+page16k+intcountry".
+#   norowid     Parts is a WITHOUT ROWID table
+#   page<N>k    page size of N KiB (the tier files use 4 KiB)
+#   bycountry   rows are stored in (madeIn, partNumber) order, and
+#               partNumber gets its own unique index
+#   intcountry  madeIn holds an integer code, named in a Countries table
+PARTS = {"rowid": {}, "norowid": {"without_rowid": True},
+         "page1k": {"page_size": 1024}, "page2k": {"page_size": 2048},
+         "page4k": {"page_size": 4096}, "page8k": {"page_size": 8192},
+         "page16k": {"page_size": 16384}, "page32k": {"page_size": 32768},
+         "page64k": {"page_size": 65536}, "bycountry": {"cluster": "madeIn"},
+         "intcountry": {"country": "INTEGER"}}
+
+DEFAULT = {"without_rowid": False, "page_size": 4096, "cluster": "partNumber",
+           "country": "TEXT"}
+
+# the layouts built by DBINIT_LAYOUTS=all, each changing one thing
+LAYOUTS = ["norowid", "page1k", "page2k", "page8k", "page16k", "page32k",
+           "page64k", "bycountry", "intcountry"]
+
+CREATE_TABLE_QUERY = '''
+    CREATE TABLE Parts (
+        partNumber INTEGER NOT NULL,
+        -- a UPC code
+        partPrice INTEGER,
+        -- in the [1, 100] range
+        needsPart INTEGER,
+        -- a UPC code
+        madeIn {country},
+        -- a country (2 letters) code, or its code in Countries
+        {key}
+    ){options};
+    '''
+
+CREATE_COUNTRIES_QUERY = '''
+    CREATE TABLE Countries (
+        code INTEGER PRIMARY KEY,
+        madeIn TEXT UNIQUE
+    );
+    '''
+
+FILL_COUNTRIES_QUERY = '''
+    INSERT INTO Countries(madeIn)
+        SELECT DISTINCT madeIn FROM source.Parts ORDER BY madeIn;
+    '''
+
+FILL_PARTS_QUERY = '''
+    INSERT INTO Parts
+        SELECT
+            p.partNumber, p.partPrice, p.needsPart, {country}
+        FROM
+            source.Parts p
+            {join}
+        ORDER BY
+            {order};
+    '''
+
+
+def parse(layout) -> Dict[str, object]:
+    spec = dict(DEFAULT)
+    for part in layout.split("+"):
+        if part not in PARTS:
+            raise ValueError("Unknown layout {}".format(part))
+        spec.update(PARTS[part])
+    return spec
+
+
+def file_path(path, layout=None) -> str:
+    # Path of the copy of the tier file at path stored in layout.
+    layout = LAYOUT if layout is None else layout
+    if layout == "rowid":
+        return path
+    directory, name = os.path.split(path)
+    return os.path.join(directory, "layouts", "{}.{}.db".format(
+        os.path.splitext(name)[0], layout))
+
+
+def create_table_query(spec) -> str:
+    if spec["cluster"] == "partNumber":
+        key = "PRIMARY KEY(partNumber)"
+    elif spec["without_rowid"]:
+        key = "PRIMARY KEY(madeIn, partNumber),\n        UNIQUE(partNumber)"
+    else:
+        # rows keep their insertion order in the rowid
+        key = "UNIQUE(partNumber)"
+    return CREATE_TABLE_QUERY.format(
+        country=spec["country"], key=key,
+        options=" WITHOUT ROWID" if spec["without_rowid"] else "")
+
+
+def build(source, target, layout) -> None:
+    # Builds the layout of the tier file source at target, replacing it.
+    spec = parse(layout)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if os.path.exists(target):
+        os.remove(target)
+    connection = sqlite3.connect(target, isolation_level=None)
+    # the page size only applies if it is set before the first table
+    connection.execute(' PRAGMA page_size={}; '.format(spec["page_size"]))
+    connection.execute(' PRAGMA journal_mode=OFF; ')
+    connection.execute(' PRAGMA synchronous=OFF; ')
+    connection.execute('ATTACH DATABASE ? AS source;', (source,))
+    connection.execute('BEGIN')
+    connection.execute(create_table_query(spec))
+    if spec["country"] == "INTEGER":
+        # codes follow the order of the country codes, so clustering by
+        # the integer gives the same order as by the text
+        connection.execute(CREATE_COUNTRIES_QUERY)
+        connection.execute(FILL_COUNTRIES_QUERY)
+        country = "c.code"
+        join = "JOIN Countries c ON c.madeIn = p.madeIn"
+    else:
+        country = "p.madeIn"
+        join = ""
+    order = "p.partNumber"
+    if spec["cluster"] == "madeIn":
+        order = "p.madeIn, p.partNumber"
+    connection.execute(FILL_PARTS_QUERY.format(country=country, join=join,
+                                               order=order))
+    connection.execute('COMMIT')
+    connection.execute('DETACH DATABASE source;')
+    connection.execute('ANALYZE;')
+    connection.close()
@@ -0,0 +1,228 @@
+import argparse
+import random
+import sqlite3
+import time
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Sequence
+
+import A4P1
+import A4P2
+import A4P3
+import A4P4
+import benchmark
+import connection_pool
+import key_sampler
+import query_executor
+import tiers
+
+# W rewrites a part's price with its own value: it takes the same locks
+# and journals like a real update without changing the data.
+WRITE_QUERY = '''
+        update
+            Parts
+        set
+            partPrice = partPrice
+        where
+            partNumber = :num;
+    '''
+
+# query text and the column of the sampled keys its parameter comes from
+QUERIES = {
+    "Q1": (A4P1.QUERY_1, "partNumber"),
+    "Q2": (A4P1.QUERY_2, "needsPart"),
+    "Q3": (A4P2.QUERY_3, None),
+    "Q4": (A4P3.QUERY_4, "madeIn"),
+    "Q5": (A4P4.QUERY_5, None),
+    "Q6": (A4P4.QUERY_6, None),
+    "W": (WRITE_QUERY, "partNumber"),
+}
+
+DEFAULT_MIX = "Q1=40,Q2=40,Q3=10,Q6=10"
+
+
+def parse_mix(mix) -> Dict[str, float]:
+    # "Q1=40,Q3=10" -> {"Q1": 40.0, "Q3": 10.0}
+    ratios = {}
+    for part in mix.split(","):
+        name, ratio = part.split("=")
+        if name not in QUERIES:
+            raise ValueError("Unknown query {} in mix".format(name))
+        ratios[name] = float(ratio)
+    return ratios
+
+
+def sample_keys(path) -> Dict[str, Sequence]:
+    return {column: key_sampler.sample(path, column)
+            for column in key_sampler.COLUMNS}
+
+
+def open_worker_connection(path, writes) -> sqlite3.Connection:
+    # timeout=0 turns off the SQLite busy handler so every SQLITE_BUSY
+    # comes back to us and is counted as a retry.
+    db_path = connection_pool.exact_path(path)
+    mode = "rw" if writes else "ro"
+    uri = "file:{}?mode={}".format(urllib.parse.quote(db_path), mode)
+    connection = sqlite3.connect(uri, uri=True, timeout=0,
+                                 isolation_level=None,
+                                 check_same_thread=False)
+    if not writes:
+        connection.execute(' PRAGMA query_only=ON; ')
+    return connection
+
+
+def execute_with_retry(connection, query, params, counts) -> None:
+    delay = 0.001
+    while True:
+        try:
+            query_executor.drain(connection.execute(query, params))
+            return
+        except sqlite3.OperationalError as error:
+            if "locked" not in str(error) and "busy" not in str(error):
+                raise
+            counts["busy_retries"] += 1
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+
+
+def worker(path, ratios, keys, duration, qps, seed) -> dict:
+    # Issues queries from the mix until duration runs out, at qps per
+    # second if given or as fast as possible otherwise. With a target
+    # rate the latency is measured from when the query was due, so time
+    # spent queued behind a slow query is counted too.
+    rng = random.Random(seed)
+    names = list(ratios)
+    weights = [ratios[name] for name in names]
+    connection = open_worker_connection(path, "W" in ratios)
+    counts = {"busy_retries": 0, "errors": 0}
+    latencies: Dict[str, List[int]] = {name: [] for name in names}
+
+    interval_ns = int(1e9 / qps) if qps else 0
+    start = time.perf_counter_ns()
+    deadline = start + int(duration * 1e9)
+    due = start
+    while due < deadline:
+        if interval_ns:
+            wait = due - time.perf_counter_ns()
+            if wait > 0:
+                time.sleep(wait / 1e9)
+        else:
+            due = time.perf_counter_ns()
+        name = rng.choices(names, weights)[0]
+        query, column = QUERIES[name]
+        params = {}
+        if column == "madeIn":
+            params = {"countrycode": rng.choice(keys[column])}
+        elif column is not None:
+            params = {"num": rng.choice(keys[column])}
+        try:
+            execute_with_retry(connection, query, params, counts)
+        except sqlite3.Error:
+            counts["errors"] += 1
+        latencies[name].append(time.perf_counter_ns() - due)
+        due += interval_ns
+    connection.close()
+    return {"latencies": latencies, "counts": counts}
+
+
+def get_journal_mode(path) -> str:
+    with connection_pool.connection(path) as connection:
+        return connection.execute(' PRAGMA journal_mode; ').fetchone()[0]
+
+
+def set_journal_mode(path, mode) -> str:
+    with connection_pool.connection(path) as connection:
+        return connection.execute(
+            ' PRAGMA journal_mode={}; '.format(mode)).fetchone()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run concurrent readers (and optional writers) against "
+                    "one tier and report throughput and latency.")
+    parser.add_argument("--tier", default="10K", choices=list(tiers.TIERS))
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--processes", action="store_true",
+                        help="run the workers as processes, not threads")
+    parser.add_argument("--qps", type=float, default=0,
+                        help="target queries per second over all workers, "
+                             "0 for as fast as possible")
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help="query ratios, e.g. Q1=60,Q3=20,W=20")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--wal", action="store_true",
+                        help="use WAL mode for the run")
+    parser.add_argument("--index", action="store_true",
+                        help="create every application's index first")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=benchmark.OUTPUT)
+    args = parser.parse_args()
+
+    path = tiers.TIERS[args.tier]
+    ratios = parse_mix(args.mix)
+    keys = sample_keys(path)
+    apps = [A4P1, A4P2, A4P3, A4P4]
+    previous_mode = get_journal_mode(path)
+    # the tier goes back to its journal mode and indexes even when a worker
+    # fails or the run is interrupted, so later benchmarks see it unchanged
+    try:
+        if args.index:
+            for app in apps:
+                tiers.update_index(path, app.DROP_INDEX_QUERY_IF_EXISTS)
+                tiers.update_index(path, app.CREATE_INDEX_QUERY)
+        set_journal_mode(path, "WAL" if args.wal else "DELETE")
+
+        executor = (ProcessPoolExecutor if args.processes
+                    else ThreadPoolExecutor)
+        per_worker_qps = args.qps / args.workers
+        t_start = time.perf_counter()
+        with executor(args.workers) as pool:
+            futures = [pool.submit(worker, path, ratios, keys,
+                                   args.duration, per_worker_qps,
+                                   args.seed + i)
+                       for i in range(0, args.workers)]
+            outcomes = [future.result() for future in futures]
+        elapsed = time.perf_counter() - t_start
+    finally:
+        # leaving WAL needs every other connection to the file closed
+        connection_pool.close_all()
+        if set_journal_mode(path, previous_mode) != previous_mode:
+            print("Could not switch {} back to {} mode".format(
+                path, previous_mode))
+        if args.index:
+            for app in apps:
+                tiers.update_index(path, app.DROP_INDEX_QUERY_IF_EXISTS)
+        connection_pool.close_all()
+
+    benchmark.set_context(application="load", tier=args.tier,
+                          index="on" if args.index else "off",
+                          journal="WAL" if args.wal else "DELETE",
+                          workers=args.workers, mix=args.mix)
+    busy = sum(outcome["counts"]["busy_retries"] for outcome in outcomes)
+    errors = sum(outcome["counts"]["errors"] for outcome in outcomes)
+    total = 0
+    for name in ratios:
+        samples = [ns for outcome in outcomes
+                   for ns in outcome["latencies"][name]]
+        if not samples:
+            continue
+        total += len(samples)
+        result = dict(benchmark.context)
+        result["query"] = name
+        result["count"] = len(samples)
+        result["qps"] = len(samples) / elapsed
+        result.update(benchmark.summarize("wall", samples))
+        benchmark.results.append(result)
+        print("{:<3} {:>8} queries {:>10.1f} qps  p50 {:.4f} ms  "
+              "p95 {:.4f} ms  p99 {:.4f} ms  max {:.4f} ms".format(
+                  name, len(samples), result["qps"], result["wall_p50_ms"],
+                  result["wall_p95_ms"], result["wall_p99_ms"],
+                  result["wall_max_ms"]))
+    print("Throughput: {:.1f} queries/sec over {:.1f} s".format(
+        total / elapsed, elapsed))
+    print("SQLITE_BUSY retries: {}, errors: {}".format(busy, errors))
+    benchmark.write_results(args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+import argparse
+import importlib
+import multiprocessing
+import os
+import random
+import sqlite3
+import urllib.parse
+from typing import List
+
+import benchmark
+import connection_pool
+import layouts
+import tiers
+import tuning
+import workload
+
+PARTS_TABLE_QUERY = '''
+    SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'Parts';
+    '''
+
+APPLICATIONS = ["A4P1", "A4P2", "A4P3", "A4P4", "A4P6"]
+
+
+def pin_cpu(cpu) -> None:
+    # Keeps this worker on one CPU so the scheduler does not move it.
+    if cpu is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {cpu})
+
+
+def run_unit(module, app, name, tier, path, index) -> None:
+    benchmark.set_context(application=app, query=name, tier=tier,
+                          index=index)
+    # applications with slow queries bound each measurement by TIME_BUDGET
+    result = benchmark.run_within(module.QUERIES[name], path,
+                                  budget=getattr(module, "TIME_BUDGET", None))
+    if result is None:
+        print("Skipping {} {} on {} entries, over the time budget".format(
+            app, name, tier))
+        return
+    result["db_size"] = os.stat(connection_pool.exact_path(path)).st_size
+    result["pid"] = os.getpid()
+
+
+def run_file(task) -> List[dict]:
+    # Runs every (application, query, index) unit of one database file.
+    # Only this worker touches the file, so creating and dropping indexes
+    # here never races with another worker.
+    tier, layout, units, conditions, seed, cpu, iterations = task
+    path = tiers.OPTIONS[tier]
+    # every path this worker opens now points at the layout's copy
+    layouts.LAYOUT = layout
+    benchmark.set_context(layout=layout)
+    pin_cpu(cpu)
+    if iterations is not None:
+        benchmark.ITERATIONS = iterations
+
+    modules = {app: importlib.import_module(app) for app, _, _ in units}
+    # the tuning profiles and cache states take turns on the file
+    for profile, state in conditions:
+        tuning.PROFILE = profile
+        tuning.STATE = state
+        benchmark.set_context(profile=profile, cache_state=state)
+        # connections opened under the previous profile keep its settings
+        connection_pool.close_all()
+        random.seed("{}:{}".format(seed, tier))
+        workload.seed("{}:{}".format(seed, tier))
+        run_units(modules, units, tier, path)
+
+    connection_pool.close_all()
+    return benchmark.results
+
+
+def run_units(modules, units, tier, path) -> None:
+    for module in modules.values():
+        tiers.update_index(path, module.DROP_INDEX_QUERY_IF_EXISTS)
+
+    for app, name, index in units:
+        if index == "off":
+            run_unit(modules[app], app, name, tier, path, index)
+    for app, module in modules.items():
+        indexed = [name for a, name, index in units
+                   if a == app and index == "on"]
+        if not indexed:
+            continue
+        tiers.update_index(path, module.CREATE_INDEX_QUERY)
+        for name in indexed:
+            run_unit(module, app, name, tier, path, "on")
+        tiers.update_index(path, module.DROP_INDEX_QUERY)
+
+
+def has_parts(path) -> bool:
+    # Whether the file at path exists and has a Parts table. A read-write
+    # connection creates an empty file where there was none, so only the
+    # table tells a generated tier from a left over empty one.
+    if not os.path.exists(path):
+        return False
+    uri = "file:{}?mode=ro".format(urllib.parse.quote(path))
+    try:
+        connection = sqlite3.connect(uri, uri=True)
+        try:
+            return connection.execute(PARTS_TABLE_QUERY).fetchone() is not None
+        finally:
+            connection.close()
+    except sqlite3.DatabaseError:
+        return False
+
+
+def make_tasks(apps, tier_names, layout_names, conditions, indexes, seed, pin,
+               iterations) -> List[tuple]:
+    cpus = []
+    if pin and hasattr(os, "sched_getaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+    units = []
+    for app in apps:
+        for name in importlib.import_module(app).QUERIES:
+            for index in indexes:
+                units.append((app, name, index))
+    tasks = []
+    for tier in tier_names:
+        for layout in layout_names:
+            path = connection_pool.exact_path(tiers.OPTIONS[tier], layout)
+            if not has_parts(path):
+                print("Skipping {} entries in layout {}, {} has no Parts "
+                      "table".format(tier, layout, path))
+                continue
+            cpu = cpus[len(tasks) % len(cpus)] if cpus else None
+            tasks.append((tier, layout, units, conditions, seed, cpu,
+                          iterations))
+    # largest files first so they do not end up running last
+    tasks.sort(key=lambda task: -os.stat(
+        connection_pool.exact_path(tiers.OPTIONS[task[0]], task[1])).st_size)
+    return tasks
+
+
+def print_summary(results) -> None:
+    # The gap between wall and CPU time is mostly time spent waiting on I/O.
+    labels = [("App", "application"), ("Q", "query"), ("Tier", "tier"),
+              ("Layout", "layout"), ("Profile", "profile"),
+              ("State", "cache_state"), ("Index", "index")]
+    row = ""
+    for header, key in labels:
+        width = max([len(header)] + [len(r[key]) for r in results]) + 2
+        row += "{:<" + str(width) + "}"
+    headers = [header for header, key in labels]
+    print((row + "{:>12}{:>12}{:>12}{:>12}{:>12}").format(
+        *headers, "mean ms", "cpu ms", "p95 ms", "p99 ms", "size"))
+    for result in results:
+        print((row + "{:>12.4f}{:>12.4f}{:>12.4f}{:>12.4f}{:>12}").format(
+            *[result[key] for header, key in labels], result["wall_mean_ms"],
+            result["cpu_mean_ms"], result["wall_p95_ms"],
+            result["wall_p99_ms"], result["db_size"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the application benchmarks on every tier in "
+                    "parallel, one worker process per database file.")
+    parser.add_argument("--apps", nargs="+", default=APPLICATIONS,
+                        choices=APPLICATIONS)
+    parser.add_argument("--tiers", nargs="+", default=list(tiers.TIERS),
+                        choices=list(tiers.OPTIONS))
+    parser.add_argument("--layouts", nargs="+", default=[layouts.LAYOUT],
+                        help="storage layouts to run each tier in, "
+                             "built with DBINIT_LAYOUTS")
+    parser.add_argument("--profiles", nargs="+", default=[tuning.PROFILE],
+                        choices=list(tuning.PROFILES),
+                        help="connection tuning profiles to run each file "
+                             "under")
+    parser.add_argument("--states", nargs="+", default=[tuning.STATE],
+                        choices=tuning.STATES,
+                        help="run with a warm cache, a cold one, or both")
+    parser.add_argument("--index", choices=["off", "on", "both"],
+                        default="both")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", default="0")
+    parser.add_argument("--iterations", type=int)
+    parser.add_argument("--pin", action="store_true",
+                        help="pin each worker to its own CPU")
+    parser.add_argument("--output", default=benchmark.OUTPUT,
+                        help="write the merged results as .json or .csv")
+    args = parser.parse_args()
+
+    indexes = ["off", "on"] if args.index == "both" else [args.index]
+    for layout in args.layouts:
+        layouts.parse(layout)
+    conditions = [(profile, state) for profile in args.profiles
+                  for state in args.states]
+    tasks = make_tasks(args.apps, args.tiers, args.layouts, conditions,
+                       indexes, args.seed, args.pin, args.iterations)
+    # a fresh process per file keeps connections, caches and seeds apart
+    merged = []
+    with multiprocessing.Pool(args.workers, maxtasksperchild=1) as pool:
+        for results in pool.imap_unordered(run_file, tasks):
+            merged.extend(results)
+
+    order = {tier: i for i, tier in enumerate(tiers.OPTIONS)}
+    merged.sort(key=lambda result: (
+        result["application"], result["query"], order[result["tier"]],
+        args.layouts.index(result["layout"]),
+        conditions.index((result["profile"], result["cache_state"])),
+        result["index"] != "off"))
+    benchmark.results.extend(merged)
+    print_summary(merged)
+    benchmark.write_results(args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+# One entry point for running a slice of the benchmarks, e.g.
+#   python3 -m parts_bench run --query Q2 --tier 100K --index on
+# Only the applications a run needs are imported, and an index is only
+# built when the file does not have it yet, so a single query on a single
+# tier takes seconds instead of a full sweep of every application.
+
+import argparse
+import importlib
+import random
+import re
+import time
+from typing import Dict, List
+
+import benchmark
+import connection_pool
+import layouts
+import parallel_runner
+import tiers
+import tuning
+import workload
+
+COUNT_INDEXES_QUERY = '''
+    SELECT count(*) FROM sqlite_master WHERE type = 'index';
+    '''
+
+
+def find_application(name, apps) -> str:
+    # The first application that has query name, importing them one by one
+    # so a run does not import applications it does not need.
+    for app in apps:
+        if name in importlib.import_module(app).QUERIES:
+            return app
+    raise SystemExit("No application has a query {}".format(name))
+
+
+def count_indexes(path) -> int:
+    with connection_pool.connection(path) as connection:
+        return connection.execute(COUNT_INDEXES_QUERY).fetchone()[0]
+
+
+def ensure_index(path, tier, module) -> bool:
+    # Builds the application's index unless the file already has it, and
+    # returns whether it was built.
+    before = count_indexes(path)
+    t_start = time.perf_counter()
+    tiers.update_index(path, re.sub(
+        r"CREATE INDEX", "CREATE INDEX IF NOT EXISTS",
+        module.CREATE_INDEX_QUERY, count=1, flags=re.IGNORECASE))
+    if count_indexes(path) == before:
+        return False
+    print("Built the index on {} entries in {:.2f} s".format(
+        tier, time.perf_counter() - t_start))
+    return True
+
+
+def run_unit(module, app, name, tier, path, index) -> None:
+    count = len(benchmark.results)
+    parallel_runner.run_unit(module, app, name, tier, path, index)
+    # nothing is added when the run went over TIME_BUDGET
+    if len(benchmark.results) > count:
+        print("{} {} on {} entries, index {}".format(app, name, tier, index))
+        benchmark.print_result(benchmark.results[-1])
+        print()
+
+
+def run_app(module, app, names, tier, index, keep_index) -> None:
+    # Runs the application's queries on one tier with its index on or off.
+    path = tiers.OPTIONS[tier]
+    built = False
+    if index == "on":
+        built = ensure_index(path, tier, module)
+    else:
+        tiers.update_index(path, module.DROP_INDEX_QUERY_IF_EXISTS)
+    for name in names:
+        run_unit(module, app, name, tier, path, index)
+    # the next run finds the file as this one found it
+    if built and not keep_index:
+        tiers.update_index(path, module.DROP_INDEX_QUERY)
+
+
+def run(apps, names, tier_names, indexes, keep_index, seed) -> List[dict]:
+    modules = {}
+    units: Dict[str, List[str]] = {}
+    for name in names:
+        app = apps[0] if len(apps) == 1 else find_application(name, apps)
+        module = modules.setdefault(app, importlib.import_module(app))
+        if name not in module.QUERIES:
+            raise SystemExit("{} has no query {}, it has {}".format(
+                app, name, ", ".join(module.QUERIES)))
+        units.setdefault(app, []).append(name)
+
+    for tier in tier_names:
+        # every tier starts from the same seed whatever ran before it
+        random.seed("{}:{}".format(seed, tier))
+        workload.seed("{}:{}".format(seed, tier))
+        for index in indexes:
+            for app, module in modules.items():
+                run_app(module, app, units[app], tier, index, keep_index)
+    return benchmark.results
+
+
+def list_queries(apps) -> None:
+    for app in apps:
+        module = importlib.import_module(app)
+        print("{}: {}".format(app, ", ".join(module.QUERIES)))
+    print("Tiers: {}".format(", ".join(tiers.OPTIONS)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="parts_bench",
+        description="Run chosen queries of the applications on chosen tiers, "
+                    "without the index rebuilds of the full scripts.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="list every application's queries")
+    run_parser = commands.add_parser(
+        "run", help="benchmark queries on tiers with or without their index")
+    run_parser.add_argument("--query", nargs="+", required=True,
+                            help="query names, e.g. Q2 or Q5join")
+    run_parser.add_argument("--app", choices=parallel_runner.APPLICATIONS,
+                            help="application of the queries, found from "
+                                 "the query names when not given")
+    run_parser.add_argument("--tier", nargs="+", default=["100K"],
+                            choices=list(tiers.OPTIONS))
+    run_parser.add_argument("--index", choices=["off", "on", "both"],
+                            default="off")
+    run_parser.add_argument("--keep-index", action="store_true",
+                            help="leave indexes this run built in place, so "
+                                 "the next run with --index on skips them")
+    run_parser.add_argument("--iterations", type=int)
+    run_parser.add_argument("--layout", default=layouts.LAYOUT)
+    run_parser.add_argument("--profile", default=tuning.PROFILE,
+                            choices=list(tuning.PROFILES))
+    run_parser.add_argument("--state", default=tuning.STATE,
+                            choices=tuning.STATES)
+    run_parser.add_argument("--seed", default="0")
+    run_parser.add_argument("--output", default=benchmark.OUTPUT,
+                            help="write the results as .json or .csv")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        list_queries(parallel_runner.APPLICATIONS)
+        return
+
+    layouts.parse(args.layout)
+    layouts.LAYOUT = args.layout
+    tuning.PROFILE = args.profile
+    tuning.STATE = args.state
+    benchmark.set_context(layout=args.layout, profile=args.profile,
+                          cache_state=args.state)
+    if args.iterations is not None:
+        benchmark.ITERATIONS = args.iterations
+    indexes = ["off", "on"] if args.index == "both" else [args.index]
+    apps = [args.app] if args.app else parallel_runner.APPLICATIONS
+    results = run(apps, args.query, args.tier, indexes, args.keep_index,
+                  args.seed)
+
+    connection_pool.close_all()
+    if results:
+        parallel_runner.print_summary(results)
+    benchmark.write_results(args.output)
+
+
+if __name__ == "__main__":
+    main()
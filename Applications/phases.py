@@ -0,0 +1,187 @@
+import io
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict
+
+# Times each phase of the timed runs separately when BENCH_PHASES=1:
+#   connect  taking a connection from the pool (opening one if needed)
+#   key      picking the lookup key
+#   execute  compiling (unless cached), binding and stepping to the first
+#            row; the sqlite3 module does not expose these separately
+#   fetch    stepping through and reading the remaining rows
+#   build    filling a temp table the query then reads (A4P4 Q5temp)
+#   commit   committing a write transaction
+#   close    handing the connection back to the pool
+# The time not spent in any phase is reported as "other".
+ENABLED = os.environ.get("BENCH_PHASES", "0") == "1"
+
+PHASES = ["connect", "key", "execute", "fetch", "build", "commit",
+          "close"]
+
+# Also profiles the timed runs: "cprofile" (deterministic, slows the runs
+# down) or "sample" (a thread records the stack every SAMPLE_INTERVAL).
+PROFILER = os.environ.get("BENCH_PROFILER")
+
+# Functions listed per profile.
+PROFILER_TOP = int(os.environ.get("BENCH_PROFILER_TOP", 15))
+
+# Seconds between two stack samples.
+SAMPLE_INTERVAL = 0.001
+
+# SQLite VM instructions between two progress handler calls while phases
+# are timed.
+PROGRESS_STEPS = 1000
+
+# whether a measurement is being timed right now
+active = False
+
+# ns spent in each phase and SQLite callback counts since start()
+totals: Dict[str, int] = {}
+counters = {"statements": 0, "progress_calls": 0}
+
+profiler = None
+sampler = None
+samples: Counter = Counter()
+
+
+class Phase:
+    # Adds the time spent in a with block to totals[name].
+    __slots__ = ("name", "t_start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.t_start = time.perf_counter_ns()
+
+    def __exit__(self, *exc):
+        totals[self.name] = (totals.get(self.name, 0) +
+                             time.perf_counter_ns() - self.t_start)
+
+
+class NoPhase:
+    # Stands in for Phase when nothing is timed, so the hooks cost one call.
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+NO_PHASE = NoPhase()
+
+
+def phase(name):
+    return Phase(name) if active else NO_PHASE
+
+
+def trace(statement) -> None:
+    # set_trace_callback() hook: counts the statements SQLite runs.
+    if active:
+        counters["statements"] += 1
+
+
+def progress() -> None:
+    # Called from the progress handler every PROGRESS_STEPS instructions.
+    if active:
+        counters["progress_calls"] += 1
+
+
+def watch(connection) -> None:
+    # Attaches the trace callback to a new connection.
+    if ENABLED:
+        connection.set_trace_callback(trace)
+
+
+def sample(thread_id, stop) -> None:
+    # Records the innermost frame of the timed thread until stop is set.
+    while not stop.wait(SAMPLE_INTERVAL):
+        frame = sys._current_frames().get(thread_id)
+        if frame is not None:
+            code = frame.f_code
+            samples["{}:{} {}".format(os.path.basename(code.co_filename),
+                                      frame.f_lineno, code.co_name)] += 1
+
+
+def start() -> None:
+    # Starts timing the phases, and profiling, of the runs that follow.
+    global active, profiler, sampler
+    if not ENABLED:
+        return
+    totals.clear()
+    for name in counters:
+        counters[name] = 0
+    if PROFILER == "cprofile":
+        # imported here, as they are the slowest imports of a plain run
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif PROFILER == "sample":
+        samples.clear()
+        stop = threading.Event()
+        thread = threading.Thread(target=sample, daemon=True, args=(
+            threading.get_ident(), stop))
+        sampler = (thread, stop)
+        thread.start()
+    active = True
+
+
+def stop(iterations, wall_ns) -> Dict[str, float]:
+    # Stops timing and returns each phase's mean ms per run, the SQLite
+    # counters per run and the phase that took the longest.
+    global active, profiler, sampler
+    if not ENABLED:
+        return {}
+    active = False
+    if profiler is not None:
+        profiler.disable()
+        print_profile(profiler)
+        profiler = None
+    if sampler is not None:
+        sampler[1].set()
+        sampler[0].join()
+        sampler = None
+        print_samples()
+    measured = {"phase_{}_ms".format(name): totals.get(name, 0) /
+                iterations / 1e6 for name in PHASES}
+    measured["phase_other_ms"] = max(
+        0.0, wall_ns / iterations / 1e6 - sum(measured.values()))
+    measured["statements_per_run"] = counters["statements"] / iterations
+    measured["vm_steps_per_run"] = (counters["progress_calls"] *
+                                    PROGRESS_STEPS / iterations)
+    measured["dominant_phase"] = max(
+        PHASES + ["other"], key=lambda name: measured[
+            "phase_{}_ms".format(name)])
+    return measured
+
+
+def print_profile(profile) -> None:
+    import pstats
+    stream = io.StringIO()
+    pstats.Stats(profile, stream=stream).sort_stats(
+        "cumulative").print_stats(PROFILER_TOP)
+    print(stream.getvalue())
+
+
+def print_samples() -> None:
+    total = sum(samples.values())
+    print("{} stack samples".format(total))
+    if not total:
+        return
+    for frame, count in samples.most_common(PROFILER_TOP):
+        print("{:6.1f}% {}".format(count / total * 100, frame))
+
+
+def print_phases(result) -> None:
+    if "dominant_phase" not in result:
+        return
+    print("Phases (ms per run): " + ", ".join(
+        "{} {:.4f}".format(name, result["phase_{}_ms".format(name)])
+        for name in PHASES + ["other"]))
+    print("Dominant phase: {}, statements per run: {}, VM steps per run: "
+          "~{:.0f}".format(result["dominant_phase"],
+                           result["statements_per_run"],
+                           result["vm_steps_per_run"]))
@@ -0,0 +1,84 @@
+import argparse
+import csv
+import json
+import sys
+from typing import Dict, List
+
+import query_plan
+
+# labels that, when a result has them, identify the same measurement in
+# two result files
+KEY_FIELDS = ("application", "query", "tier", "index", "layout", "profile",
+              "cache_state", "backend", "fetch", "cache", "keys", "strategy",
+              "batch_size", "journal", "operation", "txn_size", "workers",
+              "mix", "summary")
+
+
+def load_results(path) -> List[dict]:
+    # Reads results written by benchmark.write_results().
+    if path.endswith(".csv"):
+        with open(path, newline="") as csvfile:
+            return list(csv.DictReader(csvfile))
+    with open(path) as jsonfile:
+        return json.load(jsonfile)
+
+
+def result_key(result) -> tuple:
+    # Labels in KEY_FIELDS order. A label the result does not have is "",
+    # which is also how CSV files write it.
+    return tuple("" if result.get(f) is None else str(result[f])
+                 for f in KEY_FIELDS)
+
+
+def by_key(results) -> Dict[tuple, dict]:
+    keyed = {}
+    for result in results:
+        if result.get("plan"):
+            keyed[result_key(result)] = result
+    return keyed
+
+
+def label(key) -> str:
+    return " ".join(value for value in key if value)
+
+
+def compare(old_results, new_results) -> int:
+    # Prints every plan that changed and returns how many changes turned
+    # an index search into a full scan.
+    old = by_key(old_results)
+    new = by_key(new_results)
+    found = 0
+    for key in old:
+        if key not in new or old[key]["plan"] == new[key]["plan"]:
+            continue
+        scanned = query_plan.regressions(old[key]["plan"], new[key]["plan"])
+        found += 1 if scanned else 0
+        print("{} {}: {}".format(
+            "REGRESSION" if scanned else "Changed", label(key),
+            "SEARCH -> SCAN on " + ", ".join(scanned) if scanned else ""))
+        print("  before: {}".format(old[key]["plan"]))
+        print("  after:  {}".format(new[key]["plan"]))
+        if "fullscan_steps" in old[key] and "fullscan_steps" in new[key]:
+            print("  full scan steps: {} -> {}".format(
+                old[key]["fullscan_steps"], new[key]["fullscan_steps"]))
+    missing = [key for key in old if key not in new]
+    for key in missing:
+        print("Missing from new results: {}".format(label(key)))
+    print("{} plans compared, {} regressions".format(
+        len([key for key in old if key in new]), found))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the query plans of two benchmark result files "
+                    "and flag index searches that became full scans.")
+    parser.add_argument("old", help="baseline results (.json or .csv)")
+    parser.add_argument("new", help="results to check (.json or .csv)")
+    args = parser.parse_args()
+    if compare(load_results(args.old), load_results(args.new)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import os
+import time
+from typing import Dict, List
+
+import connection_pool
+import phases
+import query_plan
+
+# How execute_read() consumes the result set: "fetchall", "fetchmany" or
+# "iterate" (stream the rows one at a time through the cursor).
+FETCH_STRATEGY = os.environ.get("BENCH_FETCH", "fetchall")
+
+# Rows fetched per fetchmany() call.
+ARRAYSIZE = int(os.environ.get("BENCH_ARRAYSIZE", 100))
+
+# Seconds a read may run before SQLite aborts it with
+# sqlite3.OperationalError("interrupted"); None means no limit.
+TIME_LIMIT = None
+
+# SQLite VM instructions between two checks of TIME_LIMIT.
+PROGRESS_STEPS = 100000
+
+# statements compiled for the first time on a connection and statements
+# served from that connection's cache. Both are approximate: they mirror
+# the cache rather than read it, and SQLite recompiles a cached statement
+# after a schema change (e.g. CREATE INDEX), which still counts as reused.
+stats = {"compiled": 0, "reused": 0}
+
+
+def track_statement(connection, query) -> None:
+    # Mirrors the sqlite3 statement cache of the connection so we can
+    # estimate how often a query was reparsed and replanned.
+    cache = connection.statements
+    if query in cache:
+        cache.move_to_end(query)
+        stats["reused"] += 1
+        return
+    cache[query] = True
+    stats["compiled"] += 1
+    if len(cache) > connection_pool.STATEMENT_CACHE_SIZE:
+        cache.popitem(last=False)
+
+
+def value_bytes(value) -> int:
+    # Size of a column value as SQLite hands it to us.
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value.encode())
+    if isinstance(value, bytes):
+        return len(value)
+    return 8
+
+
+def drain(cursor, strategy=None, into=None) -> Dict[str, int]:
+    # Steps the cursor through every row so the whole result set is
+    # computed and delivered, and counts what was materialized. The rows
+    # are appended to into when it is given.
+    strategy = FETCH_STRATEGY if strategy is None else strategy
+    rows = 0
+    size = 0
+    if strategy == "fetchall":
+        batches = [cursor.fetchall()]
+    elif strategy == "fetchmany":
+        cursor.arraysize = ARRAYSIZE
+        batches = iter(cursor.fetchmany, [])
+    elif strategy == "iterate":
+        batches = ([row] for row in cursor)
+    else:
+        raise ValueError("Unknown fetch strategy {}".format(strategy))
+    for batch in batches:
+        if into is not None:
+            into.extend(batch)
+        for row in batch:
+            rows += 1
+            size += sum(value_bytes(value) for value in row)
+    return {"rows": rows, "bytes": size}
+
+
+def set_time_limit(connection) -> None:
+    # Makes SQLite abort the next statement on connection once it has run
+    # for TIME_LIMIT seconds, and counts VM steps when phases are timed.
+    if TIME_LIMIT is None and not phases.ENABLED:
+        connection.set_progress_handler(None, 0)
+        return
+    deadline = time.perf_counter() + (TIME_LIMIT or 0)
+
+    def handler() -> bool:
+        phases.progress()
+        # the handler stays on the connection, so it checks that a limit
+        # is still set when a later statement runs without calling this
+        return TIME_LIMIT is not None and time.perf_counter() > deadline
+
+    connection.set_progress_handler(
+        handler, phases.PROGRESS_STEPS if phases.ENABLED else PROGRESS_STEPS)
+
+
+def execute_read(path, query, params=None) -> Dict[str, int]:
+    # Runs a read-only query on a pooled read-only connection and drains
+    # its result set. No transaction is opened for it, so there is nothing
+    # to commit.
+    params = {} if params is None else params
+    with connection_pool.connection(path, read_only=True) as connection:
+        return run_read(connection, path, query, params)
+
+
+def run_read(connection, path, query, params, into=None) -> Dict[str, int]:
+    # Runs query on connection, an open connection to path, and drains it
+    # as execute_read() does, appending the rows to into when it is given.
+    track_statement(connection, query)
+    set_time_limit(connection)
+    with phases.phase("execute"):
+        cursor = connection.execute(query, params)
+    with phases.phase("fetch"):
+        result = drain(cursor, into=into)
+    # after the query, so the connection has seen any schema change
+    query_plan.capture(connection, connection_pool.exact_path(path),
+                       query, params)
+    return result
+
+
+def fetch_read(path, query, params=None) -> List[tuple]:
+    # Runs a read-only query and returns every row it produces.
+    params = {} if params is None else params
+    with connection_pool.connection(path, read_only=True) as connection:
+        track_statement(connection, query)
+        set_time_limit(connection)
+        with phases.phase("execute"):
+            cursor = connection.execute(query, params)
+        with phases.phase("fetch"):
+            return cursor.fetchall()
+
+
+def reset_stats() -> None:
+    for name in stats:
+        stats[name] = 0
+
+
+def print_stats() -> None:
+    total = stats["compiled"] + stats["reused"]
+    reuse = stats["reused"] / total * 100 if total else 0
+    # approximate, see stats
+    print("Statements compiled: ~{}, reused: ~{} ({:.1f}% reused)".format(
+        stats["compiled"], stats["reused"], reuse))
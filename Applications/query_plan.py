@@ -0,0 +1,200 @@
+import ctypes
+import os
+import re
+from typing import Dict, List
+
+import tuning
+
+# Whether run_benchmark() makes one extra untimed run that records the
+# plan and statement counters of every query fn executes.
+CAPTURE = os.environ.get("BENCH_PLANS", "1") != "0"
+
+# sqlite3_stmt_status() counters stored with every result
+COUNTERS = {
+    "fullscan_steps": 1,  # SQLITE_STMTSTATUS_FULLSCAN_STEP
+    "sorts": 2,           # SQLITE_STMTSTATUS_SORT
+    "autoindexes": 3,     # SQLITE_STMTSTATUS_AUTOINDEX
+    "vm_steps": 4,        # SQLITE_STMTSTATUS_VM_STEP
+}
+
+SQLITE_OPEN_READONLY = 1
+SQLITE_OPEN_URI = 0x40
+SQLITE_ROW = 100
+SQLITE_DONE = 101
+SQLITE_TRANSIENT = ctypes.c_void_p(-1)
+
+# plans and counters recorded since start(), or None when not capturing
+captured = None
+
+# the SQLite C library, loaded by library() on first use since finding it
+# costs more than the rest of the imports
+sqlite = None
+loaded = False
+
+
+def load_library():
+    # The sqlite3 module does not expose its statement handles, so the
+    # counters are read by preparing the query again through the C API.
+    import ctypes.util
+    name = ctypes.util.find_library("sqlite3")
+    if name is None:
+        return None
+    try:
+        lib = ctypes.CDLL(name)
+    except OSError:
+        return None
+    handle = ctypes.c_void_p
+    lib.sqlite3_open_v2.argtypes = [ctypes.c_char_p, ctypes.POINTER(handle),
+                                    ctypes.c_int, ctypes.c_char_p]
+    lib.sqlite3_close_v2.argtypes = [handle]
+    lib.sqlite3_errmsg.argtypes = [handle]
+    lib.sqlite3_errmsg.restype = ctypes.c_char_p
+    lib.sqlite3_prepare_v2.argtypes = [handle, ctypes.c_char_p, ctypes.c_int,
+                                       ctypes.POINTER(handle),
+                                       ctypes.POINTER(ctypes.c_char_p)]
+    lib.sqlite3_bind_parameter_index.argtypes = [handle, ctypes.c_char_p]
+    lib.sqlite3_bind_int64.argtypes = [handle, ctypes.c_int, ctypes.c_int64]
+    lib.sqlite3_bind_double.argtypes = [handle, ctypes.c_int, ctypes.c_double]
+    lib.sqlite3_bind_text.argtypes = [handle, ctypes.c_int, ctypes.c_char_p,
+                                      ctypes.c_int, handle]
+    lib.sqlite3_bind_null.argtypes = [handle, ctypes.c_int]
+    lib.sqlite3_step.argtypes = [handle]
+    lib.sqlite3_stmt_status.argtypes = [handle, ctypes.c_int, ctypes.c_int]
+    lib.sqlite3_finalize.argtypes = [handle]
+    return lib
+
+
+def library():
+    # The loaded SQLite C library, or None where it cannot be found.
+    global sqlite, loaded
+    if not loaded:
+        sqlite = load_library()
+        loaded = True
+    return sqlite
+
+
+def start() -> None:
+    global captured
+    captured = []
+
+
+def stop() -> Dict:
+    # Returns what was captured since start(): the plans joined with " || "
+    # and the counters summed over the queries.
+    global captured
+    found, captured = captured, None
+    if not found:
+        return {}
+    summary = {"plan": " || ".join(entry["plan"] for entry in found)}
+    for name in COUNTERS:
+        values = [entry[name] for entry in found if name in entry]
+        if values:
+            summary[name] = sum(values)
+    return summary
+
+
+def explain(connection, query, params) -> str:
+    # EXPLAIN QUERY PLAN as one line, nested steps prefixed with "-".
+    # An EXPLAIN never reads the schema cookie, so a cached one would keep
+    # the plan from before an index change; the schema version in its
+    # text makes each schema compile its own.
+    version = connection.execute(' PRAGMA schema_version; ').fetchone()[0]
+    rows = connection.execute(
+        "EXPLAIN QUERY PLAN /* schema {} */ {}".format(version, query),
+        params).fetchall()
+    depth = {0: 0}
+    lines = []
+    for node, parent, _, detail in rows:
+        depth[node] = depth.get(parent, 0) + 1
+        lines.append("-" * (depth[node] - 1) + detail)
+    return "; ".join(lines)
+
+
+def bind(stmt, params) -> None:
+    if isinstance(params, dict):
+        items = [(sqlite.sqlite3_bind_parameter_index(
+            stmt, (":" + name).encode()), value)
+            for name, value in params.items()]
+    else:
+        items = [(i + 1, value) for i, value in enumerate(params)]
+    for index, value in items:
+        if value is None:
+            sqlite.sqlite3_bind_null(stmt, index)
+        elif isinstance(value, int):
+            sqlite.sqlite3_bind_int64(stmt, index, value)
+        elif isinstance(value, float):
+            sqlite.sqlite3_bind_double(stmt, index, value)
+        else:
+            sqlite.sqlite3_bind_text(stmt, index, str(value).encode(), -1,
+                                     SQLITE_TRANSIENT)
+
+
+def statement_counters(path, query, params) -> Dict[str, int]:
+    # Runs query to completion on its own read-only connection and reads
+    # its sqlite3_stmt_status() counters.
+    if library() is None:
+        return {}
+    flags = SQLITE_OPEN_READONLY
+    if tuning.preloads():
+        # The query ran on the shared in-memory copy, which has the indexes
+        # built for the run and the file does not. The sqlite3 module links
+        # the same library, so this connection shares that copy.
+        path = tuning.memory_uri(path)
+        flags |= SQLITE_OPEN_URI
+    db = ctypes.c_void_p()
+    stmt = ctypes.c_void_p()
+    try:
+        if sqlite.sqlite3_open_v2(path.encode(), ctypes.byref(db), flags,
+                                  None):
+            return {}
+        if sqlite.sqlite3_prepare_v2(db, query.encode(), -1,
+                                     ctypes.byref(stmt), None):
+            if flags & SQLITE_OPEN_URI:
+                # a library of its own sees an empty copy, so no counters
+                return {}
+            raise RuntimeError(sqlite.sqlite3_errmsg(db).decode())
+        bind(stmt, params)
+        code = sqlite.sqlite3_step(stmt)
+        while code == SQLITE_ROW:
+            code = sqlite.sqlite3_step(stmt)
+        if code != SQLITE_DONE:
+            raise RuntimeError(sqlite.sqlite3_errmsg(db).decode())
+        return {name: sqlite.sqlite3_stmt_status(stmt, op, 0)
+                for name, op in COUNTERS.items()}
+    finally:
+        sqlite.sqlite3_finalize(stmt)
+        sqlite.sqlite3_close_v2(db)
+
+
+def capture(connection, path, query, params, counters=True) -> None:
+    # Records the plan and counters of query when a capture is running.
+    # counters is False for a query on a temp table, which the connection
+    # statement_counters() opens does not have.
+    if captured is None:
+        return
+    entry = {"plan": explain(connection, query, params)}
+    if counters:
+        entry.update(statement_counters(path, query, params))
+    captured.append(entry)
+
+
+def access_paths(plan) -> Dict[str, str]:
+    # Maps each table in plan to how it is read: "SEARCH" (through an
+    # index or the rowid) or "SCAN" (every row, even of a covering index).
+    paths = {}
+    for step in re.split(r";|\|\|", plan or ""):
+        match = re.match(r"\s*-*\s*(SCAN|SEARCH)(?: TABLE)? (\w+)", step)
+        if match:
+            access, table = match.groups()
+            # a table read both ways in one plan counts as scanned
+            if paths.get(table) != "SCAN":
+                paths[table] = access
+    return paths
+
+
+def regressions(old_plan, new_plan) -> List[str]:
+    # Tables that old_plan searched and new_plan scans in full.
+    old = access_paths(old_plan)
+    new = access_paths(new_plan)
+    return [table for table, access in new.items()
+            if access == "SCAN" and old.get(table) == "SEARCH"]
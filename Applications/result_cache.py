@@ -0,0 +1,119 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+import connection_pool
+import query_executor
+
+# Serve repeated reads from memory. Off unless BENCH_CACHE=1.
+ENABLED = os.environ.get("BENCH_CACHE", "0") == "1"
+
+# Results kept before the least recently used one is evicted.
+CAPACITY = int(os.environ.get("BENCH_CACHE_SIZE", 10000))
+
+# Seconds a result is served for, 0 to keep it until it is evicted or the
+# database changes.
+TTL = float(os.environ.get("BENCH_CACHE_TTL", 60))
+
+# cached results keyed by (absolute path, query, params), in least recently
+# used order, with when they expire
+entries: "OrderedDict[tuple, Tuple[float, List[tuple], Dict[str, int]]]" = \
+    OrderedDict()
+
+stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0,
+         "invalidations": 0}
+
+
+def params_key(params) -> tuple:
+    if isinstance(params, dict):
+        return tuple(sorted(params.items()))
+    return tuple(params)
+
+
+def invalidate(db_path) -> None:
+    # Drops every result of the database at db_path.
+    stale = [key for key in entries if key[0] == db_path]
+    for key in stale:
+        del entries[key]
+    stats["invalidations"] += 1
+
+
+def check_version(db_path, connection) -> None:
+    # PRAGMA data_version changes when another connection commits to the
+    # file, even from another process. Its value is only comparable on the
+    # same connection, so a connection not seen before invalidates too.
+    version = connection.execute(' PRAGMA data_version; ').fetchone()[0]
+    if connection.data_version != version:
+        if connection.data_version is not None or any(
+                key[0] == db_path for key in entries):
+            invalidate(db_path)
+        connection.data_version = version
+
+
+def fetch_read(path, query, params=None) -> List[tuple]:
+    # Like query_executor.fetch_read(), answered from the cache when the
+    # same query and params were read before and the database has not
+    # changed since.
+    return cached(path, query, params)[0]
+
+
+def execute_read(path, query, params=None) -> Dict[str, int]:
+    # Like query_executor.execute_read(); goes straight to SQLite when the
+    # cache is off. cache_hits is 1 when the result came from the cache.
+    params = {} if params is None else params
+    if not ENABLED:
+        return query_executor.execute_read(path, query, params)
+    hits = stats["hits"]
+    counts = dict(cached(path, query, params)[1])
+    counts["cache_hits"] = stats["hits"] - hits
+    return counts
+
+
+def cached(path, query, params) -> Tuple[List[tuple], Dict[str, int]]:
+    params = {} if params is None else params
+    db_path = connection_pool.exact_path(path)
+    key = (db_path, query, params_key(params))
+    with connection_pool.connection(path, read_only=True) as connection:
+        check_version(db_path, connection)
+        now = time.monotonic()
+        entry = entries.get(key)
+        if entry is not None:
+            if not TTL or entry[0] > now:
+                entries.move_to_end(key)
+                stats["hits"] += 1
+                return entry[1], entry[2]
+            del entries[key]
+            stats["expired"] += 1
+
+        stats["misses"] += 1
+        # a miss is read as an uncached read would be, with BENCH_FETCH,
+        # statement tracking and plan capture, keeping the rows it drains
+        rows: List[tuple] = []
+        counts = query_executor.run_read(connection, path, query, params,
+                                         into=rows)
+    entries[key] = (now + TTL, rows, counts)
+    if len(entries) > CAPACITY:
+        entries.popitem(last=False)
+        stats["evictions"] += 1
+    return rows, counts
+
+
+def clear() -> None:
+    entries.clear()
+
+
+def reset_stats() -> None:
+    for name in stats:
+        stats[name] = 0
+
+
+def print_stats() -> None:
+    if not ENABLED:
+        return
+    total = stats["hits"] + stats["misses"]
+    ratio = stats["hits"] / total * 100 if total else 0
+    print("Result cache hits: {}, misses: {} ({:.1f}% hits), evictions: {}, "
+          "expired: {}, invalidations: {}".format(
+              stats["hits"], stats["misses"], ratio, stats["evictions"],
+              stats["expired"], stats["invalidations"]))
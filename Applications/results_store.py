@@ -0,0 +1,267 @@
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+from typing import Dict, List, Optional, Tuple
+
+import plan_diff
+
+# SQLite database every run's results are added to by
+# benchmark.write_results(). Nothing is stored when it is not set.
+STORE = os.environ.get("BENCH_STORE")
+
+# A change is only reported when the medians differ by more than this
+# share, however significant it is.
+THRESHOLD = 0.05
+
+# significance level of the Mann-Whitney U test
+ALPHA = 0.01
+
+CREATE_QUERIES = [
+    '''
+    CREATE TABLE IF NOT EXISTS Runs (
+        runId INTEGER PRIMARY KEY,
+        startedAt TEXT,
+        -- UTC, ISO 8601
+        revision TEXT,
+        -- git commit of the applications
+        dirty INTEGER,
+        -- 1 when the working tree had uncommitted changes
+        python TEXT,
+        sqlite TEXT,
+        platform TEXT,
+        command TEXT
+    );
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS Results (
+        resultId INTEGER PRIMARY KEY,
+        runId INTEGER REFERENCES Runs(runId),
+        application TEXT,
+        query TEXT,
+        tier TEXT,
+        indexState TEXT,
+        matchKey TEXT,
+        -- JSON of the plan_diff.KEY_FIELDS labels the result has
+        wallMeanMs REAL,
+        wallP50Ms REAL,
+        wallP99Ms REAL,
+        samples TEXT,
+        -- JSON list of every timed run's wall time in ns
+        fields TEXT
+        -- JSON of the whole result without the samples
+    );
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS idxResultsRun ON Results ( runId, matchKey );
+    ''',
+]
+
+
+def connect(path) -> sqlite3.Connection:
+    connection = sqlite3.connect(path)
+    for query in CREATE_QUERIES:
+        connection.execute(query)
+    return connection
+
+
+def revision() -> Tuple[Optional[str], Optional[int]]:
+    # git commit and whether the tree is dirty, or None outside a checkout.
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(
+            ["git", "-C", directory, "rev-parse", "HEAD"],
+            capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(
+            ["git", "-C", directory, "status", "--porcelain"],
+            capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, 1 if status.strip() else 0
+
+
+def match_key(result) -> str:
+    return json.dumps({field: str(result[field])
+                       for field in plan_diff.KEY_FIELDS
+                       if result.get(field) not in (None, "")},
+                      sort_keys=True)
+
+
+def save(results, path=None) -> Optional[int]:
+    # Adds a run with every result to the store and returns its runId.
+    path = STORE if path is None else path
+    if not path or not results:
+        return None
+    connection = connect(path)
+    commit, dirty = revision()
+    cursor = connection.execute(
+        'INSERT INTO Runs VALUES(NULL, ?, ?, ?, ?, ?, ?, ?);',
+        (datetime.datetime.now(datetime.timezone.utc).isoformat(), commit,
+         dirty, platform.python_version(), sqlite3.sqlite_version,
+         platform.platform(), " ".join(sys.argv)))
+    run_id = cursor.lastrowid
+    connection.executemany(
+        'INSERT INTO Results VALUES(NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);',
+        [(run_id, result.get("application"), result.get("query"),
+          result.get("tier"), result.get("index"), match_key(result),
+          result.get("wall_mean_ms"), result.get("wall_p50_ms"),
+          result.get("wall_p99_ms"),
+          json.dumps(result["wall_samples_ns"])
+          if "wall_samples_ns" in result else None,
+          json.dumps({name: value for name, value in result.items()
+                      if not name.endswith("_samples_ns")}))
+         for result in results])
+    connection.commit()
+    connection.close()
+    print("Results stored as run {} in {}".format(run_id, path))
+    return run_id
+
+
+def load_run(connection, run_id) -> Dict[str, List[int]]:
+    # Wall time samples of every result of the run, by match key.
+    return {key: json.loads(samples) for key, samples in connection.execute(
+        '''
+        SELECT
+            matchKey, samples
+        FROM
+            Results
+        WHERE
+            runId = :run
+            AND samples IS NOT NULL;
+        ''', {"run": run_id})}
+
+
+def latest_runs(connection, count) -> List[int]:
+    return [row[0] for row in connection.execute(
+        'SELECT runId FROM Runs ORDER BY runId DESC LIMIT ?;', (count,))][::-1]
+
+
+def median(samples) -> float:
+    ordered = sorted(samples)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2
+
+
+def mann_whitney(old, new) -> float:
+    # Two-sided p-value of the Mann-Whitney U test, by the normal
+    # approximation with tie correction.
+    n1, n2 = len(old), len(new)
+    if not n1 or not n2:
+        return 1.0
+    combined = sorted([(value, 0) for value in old] +
+                      [(value, 1) for value in new])
+    n = n1 + n2
+    rank_sum = 0.0
+    ties = 0.0
+    i = 0
+    while i < n:
+        j = i
+        while j + 1 < n and combined[j + 1][0] == combined[i][0]:
+            j += 1
+        # tied values share the average of their ranks
+        rank = (i + j) / 2 + 1
+        rank_sum += rank * sum(1 for k in range(i, j + 1)
+                               if combined[k][1] == 0)
+        tied = j - i + 1
+        ties += tied ** 3 - tied
+        i = j + 1
+    u = rank_sum - n1 * (n1 + 1) / 2
+    mean = n1 * n2 / 2
+    variance = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0
+    z = (abs(u - mean) - 0.5) / math.sqrt(variance)
+    return math.erfc(max(z, 0) / math.sqrt(2))
+
+
+def compare(connection, old_id, new_id, alpha=ALPHA,
+            threshold=THRESHOLD) -> int:
+    # Prints the speedup of every measurement the two runs share and
+    # returns how many got significantly slower.
+    old = load_run(connection, old_id)
+    new = load_run(connection, new_id)
+    regressions = 0
+    print("Run {} -> run {}".format(old_id, new_id))
+    for key in sorted(old):
+        if key not in new:
+            print("Missing from run {}: {}".format(new_id, key))
+            continue
+        before = median(old[key]) / 1e6
+        after = median(new[key]) / 1e6
+        speedup = before / after if after else float("inf")
+        p = mann_whitney(old[key], new[key])
+        status = "same"
+        if p < alpha and abs(after - before) > threshold * before:
+            status = "REGRESSION" if after > before else "faster"
+        regressions += 1 if status == "REGRESSION" else 0
+        labels = json.loads(key)
+        print("{:<10} {}: {:.4f} -> {:.4f} ms (x{:.2f}, p={:.3g})".format(
+            status, " ".join(labels[field] for field in plan_diff.KEY_FIELDS
+                             if field in labels),
+            before, after, speedup, p))
+    print("{} measurements compared, {} regressions".format(
+        len([key for key in old if key in new]), regressions))
+    return regressions
+
+
+def list_runs(connection) -> None:
+    for row in connection.execute(
+            '''
+            SELECT
+                r.runId, r.startedAt, r.revision, r.dirty, r.python,
+                r.sqlite, count(s.resultId)
+            FROM
+                Runs r
+                LEFT JOIN Results s ON s.runId = r.runId
+            GROUP BY
+                r.runId
+            ORDER BY
+                r.runId;
+            '''):
+        print("{:>5} {} {}{} python {} sqlite {}, {} results".format(
+            row[0], row[1], (row[2] or "unknown")[:10],
+            "+" if row[3] else "", row[4], row[5], row[6]))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Keep benchmark results across runs and compare two "
+                    "runs for significant speedups and regressions.")
+    parser.add_argument("--store", default=STORE, required=STORE is None,
+                        help="results database (BENCH_STORE)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="list the stored runs")
+    compare_parser = commands.add_parser(
+        "compare", help="compare two runs, the latest two by default; "
+                        "exits with status 1 on a regression")
+    compare_parser.add_argument("runs", nargs="*", type=int)
+    compare_parser.add_argument("--alpha", type=float, default=ALPHA)
+    compare_parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    import_parser = commands.add_parser(
+        "import", help="store a results file written with BENCH_OUTPUT")
+    import_parser.add_argument("file")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        save(plan_diff.load_results(args.file), args.store)
+        return
+    connection = connect(args.store)
+    if args.command == "list":
+        list_runs(connection)
+        return
+    runs = args.runs or latest_runs(connection, 2)
+    if len(runs) != 2:
+        parser.error("compare needs two runs")
+    if compare(connection, runs[0], runs[1], args.alpha, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+import argparse
+import os
+import random
+import time
+from typing import Dict, List
+
+import benchmark
+import columnar
+import connection_pool
+import key_sampler
+import query_executor
+import tiers
+
+# Answers Q3 and Q4 in A4P2 and A4P3 from the summary when BENCH_SUMMARY=1.
+# It is built on first use and dropped again at the end of the run.
+ENABLED = os.environ.get("BENCH_SUMMARY", "0") == "1"
+
+# One row per country in Parts, kept current by the triggers below, so Q3
+# and Q4 read #countries rows instead of scanning Parts.
+CREATE_SUMMARY_QUERY = '''
+    CREATE TABLE {schema}.CountrySummary (
+        madeIn TEXT PRIMARY KEY,
+        priceSum INTEGER,
+        partCount INTEGER,
+        maxPrice INTEGER,
+        -- partNumber of a part with maxPrice
+        maxPartNumber INTEGER
+    );
+    '''
+
+# SQLite takes the bare partNumber from the row that max() picked
+POPULATE_SUMMARY_QUERY = '''
+    INSERT INTO {schema}.CountrySummary
+    SELECT
+        madeIn, sum(partPrice), count(*), max(partPrice), partNumber
+    FROM
+        {schema}.Parts
+    GROUP BY
+        madeIn;
+    '''
+
+# Adds a part to its country. The right-hand sides of an upsert see the
+# row as it was, so maxPartNumber is compared with the old maxPrice.
+ADD_PART = '''
+        INSERT INTO CountrySummary
+            VALUES(new.madeIn, new.partPrice, 1, new.partPrice,
+                   new.partNumber)
+        ON CONFLICT(madeIn) DO UPDATE SET
+            priceSum = priceSum + excluded.priceSum,
+            partCount = partCount + 1,
+            maxPrice = max(maxPrice, excluded.maxPrice),
+            maxPartNumber = CASE WHEN excluded.maxPrice > maxPrice
+                THEN excluded.maxPartNumber ELSE maxPartNumber END;
+    '''
+
+# Removes a part from its country. Only removing the most expensive part
+# looks at Parts again, which is a search with idxPartPriceMadeIn and a
+# scan without it.
+REMOVE_PART = '''
+        UPDATE CountrySummary SET
+            priceSum = priceSum - old.partPrice,
+            partCount = partCount - 1
+        WHERE madeIn = old.madeIn;
+        UPDATE CountrySummary SET
+            (maxPrice, maxPartNumber) = (
+                SELECT partPrice, partNumber FROM Parts
+                WHERE madeIn = old.madeIn
+                ORDER BY partPrice DESC LIMIT 1)
+        WHERE madeIn = old.madeIn AND maxPartNumber = old.partNumber;
+        DELETE FROM CountrySummary
+        WHERE madeIn = old.madeIn AND partCount = 0;
+    '''
+
+CREATE_TRIGGER_QUERIES = [
+    '''
+    CREATE TRIGGER {schema}.CountrySummaryInsert AFTER INSERT ON Parts
+    BEGIN''' + ADD_PART + '''END;
+    ''',
+    '''
+    CREATE TRIGGER {schema}.CountrySummaryDelete AFTER DELETE ON Parts
+    BEGIN''' + REMOVE_PART + '''END;
+    ''',
+    '''
+    CREATE TRIGGER {schema}.CountrySummaryUpdate
+    AFTER UPDATE OF partNumber, partPrice, madeIn ON Parts
+    BEGIN''' + REMOVE_PART + ADD_PART + '''END;
+    ''',
+]
+
+DROP_SUMMARY_QUERIES = [
+    'DROP TRIGGER IF EXISTS {schema}.CountrySummaryInsert;',
+    'DROP TRIGGER IF EXISTS {schema}.CountrySummaryDelete;',
+    'DROP TRIGGER IF EXISTS {schema}.CountrySummaryUpdate;',
+    'DROP TABLE IF EXISTS {schema}.CountrySummary;',
+]
+
+# Q3 from the summary, in madeIn order like the group by
+QUERY_3 = '''
+        select
+            cast(priceSum as real) / partCount
+        from
+            CountrySummary
+        order by
+            madeIn;
+    '''
+
+# Q4 from the summary
+QUERY_4 = '''
+        select
+            maxPartNumber
+        from
+            CountrySummary
+        where
+            madeIn = :countrycode;
+    '''
+
+# Q3 and Q4 on Parts as A4P2 and A4P3 run them, which the summary answers
+# are checked and timed against by bench. They are kept here so this
+# module does not import the applications that import it.
+PARTS_QUERY_3 = '''
+        select
+            avg(partPrice)
+        from
+            Parts
+        group by
+            madeIn;
+    '''
+
+PARTS_QUERY_4 = '''
+        select
+            p1.partNumber
+        from
+            Parts p1
+        where
+            p1.madeIn = :countrycode
+            and p1.partPrice = (
+                select
+                    max(partPrice)
+                from
+                    Parts p2
+                where
+                    p2.madeIn = :countrycode
+            )
+        limit   1;
+    '''
+
+# Rows inserted, updated and deleted (then rolled back) to measure what
+# the triggers add to each write.
+WRITE_ROWS = 1000
+
+# databases whose summary ensure() built, dropped again by remove_built()
+built: List[str] = []
+
+
+def enabled() -> bool:
+    return ENABLED
+
+
+def backend() -> str:
+    # The backend label of A4P2 and A4P3 results.
+    return "summary" if ENABLED else columnar.BACKEND
+
+
+def build(connection, schema="main") -> None:
+    # (Re)creates the summary of schema.Parts and its triggers. Runs in the
+    # caller's transaction.
+    drop(connection, schema)
+    connection.execute(CREATE_SUMMARY_QUERY.format(schema=schema))
+    connection.execute(POPULATE_SUMMARY_QUERY.format(schema=schema))
+    for query in CREATE_TRIGGER_QUERIES:
+        connection.execute(query.format(schema=schema))
+
+
+def drop(connection, schema="main") -> None:
+    for query in DROP_SUMMARY_QUERIES:
+        connection.execute(query.format(schema=schema))
+
+
+def exists(connection, schema="main") -> bool:
+    return connection.execute(
+        "SELECT count(*) FROM {}.sqlite_master "
+        "WHERE type = 'table' AND name = 'CountrySummary';".format(
+            schema)).fetchone()[0] > 0
+
+
+def triggered(connection) -> bool:
+    # Whether writes to Parts also update a CountrySummary, which adds the
+    # triggers' cost to every write.
+    return connection.execute(
+        "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' "
+        "AND name LIKE 'CountrySummary%';").fetchone()[0] > 0
+
+
+def warn_triggered(tier) -> None:
+    print("{} entries has the CountrySummary triggers, so its writes include "
+          "their cost (python3 summary.py drop removes them)".format(tier))
+
+
+def ensure(path) -> None:
+    # Builds the summary of the database at path unless it has one.
+    with connection_pool.connection(path) as connection:
+        if not exists(connection):
+            build(connection)
+            connection.commit()
+            built.append(path)
+
+
+def remove(path) -> None:
+    with connection_pool.connection(path) as connection:
+        drop(connection)
+        connection.commit()
+
+
+def remove_built() -> None:
+    # Drops every summary ensure() built, so the tiers do not keep
+    # triggers that slow down every later write.
+    while built:
+        remove(built.pop())
+
+
+def verify(path, name, query, param_name=None) -> bool:
+    # Checks the summary answers for Q3 or Q4 against query on Parts and
+    # prints any mismatch.
+    if name == "Q3":
+        expected = query_executor.fetch_read(path, query)
+        answer = query_executor.fetch_read(path, QUERY_3)
+        differing = [] if len(expected) == len(answer) and all(
+            abs(e[0] - a[0]) < 1e-9
+            for e, a in zip(expected, answer)) else [()]
+    else:
+        differing = []
+        for code in key_sampler.sample(path, "madeIn")[:columnar.VERIFY_KEYS]:
+            expected = query_executor.fetch_read(path, query,
+                                                 {param_name: code})
+            answer = query_executor.fetch_read(path, QUERY_4,
+                                               {"countrycode": code})
+            # ties on the max price may pick a different part, so compare
+            # the prices of the parts chosen
+            if price_of(path, expected) != price_of(path, answer):
+                differing.append((code,))
+    for params in differing:
+        print("Summary {} differs from SQLite for {} on {}".format(
+            name, params, path))
+    return not differing
+
+
+def price_of(path, rows) -> List[int]:
+    return [query_executor.fetch_read(
+        path, 'select partPrice from Parts where partNumber = :num;',
+        {"num": row[0]})[0][0] for row in rows]
+
+
+def time_writes(path) -> Dict[str, float]:
+    # ms per inserted, updated and deleted row, on WRITE_ROWS fresh rows in
+    # one transaction that is rolled back afterwards.
+    codes = key_sampler.sample(path, "madeIn")
+    with connection_pool.connection(path) as connection:
+        top = connection.execute(
+            "select max(partNumber), max(needsPart) from Parts").fetchone()
+        start = max(top[0] or 0, top[1] or 0) + 1
+        rows = [(start + i, random.randint(0, 100), start + i,
+                 random.choice(codes)) for i in range(0, WRITE_ROWS)]
+        steps = [
+            ("insert", "INSERT INTO Parts VALUES(?, ?, ?, ?)", rows),
+            ("update", "UPDATE Parts SET partPrice = ? WHERE partNumber = ?",
+             [(random.randint(0, 100), row[0]) for row in rows]),
+            ("delete", "DELETE FROM Parts WHERE partNumber = ?",
+             [(row[0],) for row in rows]),
+        ]
+        timings = {}
+        for name, query, params in steps:
+            t_start = time.perf_counter()
+            connection.executemany(query, params)
+            timings[name] = (time.perf_counter() - t_start) * 1000 / len(rows)
+        connection.rollback()
+    return timings
+
+
+def run_parts_query_3(path) -> Dict[str, int]:
+    return query_executor.execute_read(path, PARTS_QUERY_3)
+
+
+def run_parts_query_4(path) -> Dict[str, int]:
+    return query_executor.execute_read(path, PARTS_QUERY_4, {
+        "countrycode": key_sampler.choice(path, "madeIn")})
+
+
+def run_query_3(path) -> Dict[str, int]:
+    return query_executor.execute_read(path, QUERY_3)
+
+
+def run_query_4(path) -> Dict[str, int]:
+    return query_executor.execute_read(path, QUERY_4, {
+        "countrycode": key_sampler.choice(path, "madeIn")})
+
+
+def measure_tier(tier) -> List[dict]:
+    # Times Q3 and Q4 on Parts and on the summary, and each kind of write
+    # without and with the triggers.
+    path = tiers.TIERS[tier]
+    remove(path)
+    plain = {"Q3": run_parts_query_3, "Q4": run_parts_query_4}
+    summarized = {"Q3": run_query_3, "Q4": run_query_4}
+
+    benchmark.set_context(tier=tier)
+    measured = []
+    for name, fn in plain.items():
+        benchmark.set_context(query=name, backend="sqlite")
+        measured.append(benchmark.run_benchmark(fn, path))
+    without = time_writes(path)
+
+    ensure(path)
+    verify(path, "Q3", PARTS_QUERY_3)
+    verify(path, "Q4", PARTS_QUERY_4, "countrycode")
+    for name, fn in summarized.items():
+        benchmark.set_context(query=name, backend="summary")
+        measured.append(benchmark.run_benchmark(fn, path))
+    with_triggers = time_writes(path)
+
+    print("{} entries".format(tier))
+    for name in plain:
+        before, after = [result["wall_mean_ms"] for result in measured
+                         if result["query"] == name]
+        print("  {} {:.4f} ms -> {:.4f} ms (x{:.1f})".format(
+            name, before, after, before / after if after else 0))
+    for name in without:
+        print("  {} {:.4f} ms/row -> {:.4f} ms/row with triggers "
+              "(+{:.4f})".format(name, without[name], with_triggers[name],
+                                 with_triggers[name] - without[name]))
+        for result in measured:
+            if result["backend"] == "summary":
+                result[name + "_overhead_ms"] = (with_triggers[name]
+                                                 - without[name])
+    return measured
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build or drop the CountrySummary table, or measure the "
+                    "read speedup and trigger overhead it gives each tier.")
+    parser.add_argument("action", choices=["build", "drop", "bench"])
+    parser.add_argument("--tiers", nargs="+", default=list(tiers.TIERS),
+                        choices=list(tiers.TIERS))
+    parser.add_argument("--keep", action="store_true",
+                        help="keep the summary after bench")
+    args = parser.parse_args()
+
+    benchmark.set_context(application="summary",
+                          fetch=query_executor.FETCH_STRATEGY, index="off")
+    for tier in args.tiers:
+        path = tiers.TIERS[tier]
+        if args.action == "build":
+            remove(path)
+            ensure(path)
+        elif args.action == "drop":
+            remove(path)
+        else:
+            measure_tier(tier)
+            if not args.keep:
+                remove(path)
+    connection_pool.close_all()
+    benchmark.write_results()
+
+
+if __name__ == "__main__":
+    main()
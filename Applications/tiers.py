@@ -0,0 +1,29 @@
+import connection_pool
+
+V100_DB_PATH = "../SQLiteDBs/A4v100.db"
+V1K_DB_PATH = "../SQLiteDBs/A4v1k.db"
+V10K_DB_PATH = "../SQLiteDBs/A4v10k.db"
+V100K_DB_PATH = "../SQLiteDBs/A4v100k.db"
+V1M_DB_PATH = "../SQLiteDBs/A4v1M.db"
+V10M_DB_PATH = "../SQLiteDBs/A4v10M.db"
+V100M_DB_PATH = "../SQLiteDBs/A4v100M.db"
+
+# the tiers run by default
+TIERS = {"100": V100_DB_PATH, "1K": V1K_DB_PATH,
+         "10K": V10K_DB_PATH, "100K": V100K_DB_PATH, "1M": V1M_DB_PATH}
+
+# every tier, including the ones Setup/synthetic.py generates
+OPTIONS = dict(TIERS, **{"10M": V10M_DB_PATH, "100M": V100M_DB_PATH})
+
+
+def update_index(path, query) -> None:
+    # Runs an index statement such as CREATE INDEX on path and commits it.
+    with connection_pool.connection(path) as connection:
+        connection.execute(query)
+        connection.commit()
+
+
+def update_indexes(options, query) -> None:
+    # update_index() on the file of every tier in options.
+    for path in options.values():
+        update_index(path, query)
@@ -0,0 +1,85 @@
+import os
+import sqlite3
+import time
+from typing import Dict
+
+# Which connection settings every new connection gets:
+#   default  SQLite's defaults
+#   mmap     reads go through a memory map of up to 1 GiB
+#   cache    a 256 MiB page cache per connection
+#   tuned    mmap, cache and temp tables in memory
+#   memory   the tier is copied into a shared in-memory database with
+#            backup() on first use, and every connection reads the copy
+PROFILE = os.environ.get("BENCH_PROFILE", "default")
+
+PROFILES: Dict[str, dict] = {
+    "default": {},
+    "mmap": {"mmap_size": 2 ** 30},
+    "cache": {"cache_size": -262144},
+    "tuned": {"mmap_size": 2 ** 30, "cache_size": -262144,
+              "temp_store": "MEMORY"},
+    "memory": {"temp_store": "MEMORY", "preload": True},
+}
+
+# "warm" (default) times runs back to back, so they find the pages the
+# previous run read in SQLite's page cache and the OS cache. "cold" closes
+# every pooled connection and drops the file from the OS cache before each
+# timed run.
+STATE = os.environ.get("BENCH_CACHE_STATE", "warm")
+
+STATES = ["warm", "cold"]
+
+# connections holding the in-memory copies open, keyed by absolute path of
+# the file they were loaded from, with the name of the copy
+copies: Dict[str, tuple] = {}
+
+
+def settings() -> dict:
+    if PROFILE not in PROFILES:
+        raise ValueError("Unknown tuning profile {}".format(PROFILE))
+    return PROFILES[PROFILE]
+
+
+def apply(connection) -> None:
+    # Sets the profile's PRAGMAs on a new connection.
+    for name in ("mmap_size", "cache_size", "temp_store"):
+        if name in settings():
+            connection.execute(' PRAGMA {}={}; '.format(
+                name, settings()[name]))
+
+
+def preloads() -> bool:
+    return settings().get("preload", False)
+
+
+def memory_uri(path) -> str:
+    # URI of the shared in-memory copy of the file at path, loading it the
+    # first time. The copy lives as long as the process, since the
+    # connection that loaded it is never closed.
+    if path not in copies:
+        name = "file:tier{}?mode=memory&cache=shared".format(len(copies))
+        keeper = sqlite3.connect(name, uri=True)
+        t_start = time.perf_counter()
+        source = sqlite3.connect(path)
+        source.backup(keeper)
+        source.close()
+        print("Loaded {} into memory in {:.2f} ms".format(
+            os.path.basename(path), (time.perf_counter() - t_start) * 1000))
+        copies[path] = (name, keeper)
+    return copies[path][0]
+
+
+def drop_os_cache(path) -> bool:
+    # Asks the kernel to forget its cached pages of the file at path.
+    # Writing a fresh copy of the file would leave the copy's own pages
+    # cached, so this uses posix_fadvise instead. Dirty pages cannot be
+    # dropped, hence the fsync. Returns False where fadvise is missing.
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return True
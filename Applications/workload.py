@@ -0,0 +1,238 @@
+import argparse
+import atexit
+import json
+import os
+import random
+import string
+from typing import Dict, List, Sequence
+
+import connection_pool
+import key_sampler
+import phases
+import query_executor
+import tiers
+
+# How next_key() picks lookup keys among the sampled ones:
+#   uniform     every key equally often
+#   zipf        the key at rank r with weight 1 / r**ZIPF_S
+#   hotspot     HOTSPOT_SHARE of the lookups go to HOTSPOT_KEYS of the keys
+#   sequential  the keys in ascending order, wrapping around
+DISTRIBUTION = os.environ.get("BENCH_KEY_DISTRIBUTION", "uniform")
+
+DISTRIBUTIONS = ["uniform", "zipf", "hotspot", "sequential"]
+
+# Skew of the zipf distribution; larger is more skewed.
+ZIPF_S = float(os.environ.get("BENCH_ZIPF_S", 1.1))
+
+# Share of the keys that are hot, and share of the lookups that hit them.
+HOTSPOT_KEYS = float(os.environ.get("BENCH_HOTSPOT_KEYS", 0.1))
+HOTSPOT_SHARE = float(os.environ.get("BENCH_HOTSPOT_SHARE", 0.9))
+
+# Share of the lookups made with a key that is not in Parts.
+MISS_RATE = float(os.environ.get("BENCH_MISS_RATE", 0))
+
+# Keys known to be missing that misses are drawn from, per column.
+MISS_KEYS = 1000
+
+# With a seed the keys are sampled with key_sampler's "hash" method and
+# drawn from a seeded generator, so two runs see the same key stream.
+SEED = os.environ.get("BENCH_SEED")
+
+# Replays the keys of this trace file instead of drawing new ones.
+TRACE = os.environ.get("BENCH_TRACE")
+
+# Writes every key drawn to this trace file when the process exits.
+RECORD = os.environ.get("BENCH_TRACE_RECORD")
+
+rng = random.Random(SEED)
+
+# keys in ascending order for sequential, cumulative zipf weights, keys
+# missing from Parts, the next position of sequential and trace replay,
+# all keyed by (database file name, column)
+sorted_keys: Dict[tuple, list] = {}
+zipf_weights: Dict[int, List[float]] = {}
+missing: Dict[tuple, list] = {}
+positions: Dict[tuple, int] = {}
+
+# keys of the trace being replayed and keys recorded so far, each as
+# [database file name, column, key]
+replay: Dict[tuple, list] = {}
+recorded: List[list] = []
+
+
+def seed(value) -> None:
+    # Restarts the key stream from value and samples keys with the "hash"
+    # method from now on, so two runs seeded alike draw the same keys. Called
+    # once per tier, a tier sees the same keys whatever ran before it.
+    global SEED
+    SEED = str(value)
+    key_sampler.SEED = key_sampler.seed_value(SEED)
+    rng.seed(SEED)
+
+
+def trace_key(path, column) -> tuple:
+    # Traces name the file, not its path, so they replay from any
+    # directory.
+    return (os.path.basename(connection_pool.exact_path(path)), column)
+
+
+def keys_of(path, column) -> Sequence:
+    method = "hash" if SEED is not None else None
+    return key_sampler.sample(path, column, method=method)
+
+
+def cumulative_zipf(n) -> List[float]:
+    if n not in zipf_weights:
+        total = 0.0
+        weights = []
+        for rank in range(1, n + 1):
+            total += 1 / rank ** ZIPF_S
+            weights.append(total)
+        zipf_weights[n] = weights
+    return zipf_weights[n]
+
+
+def missing_keys(path, column) -> list:
+    # MISS_KEYS keys of column's type that no row of Parts has.
+    name = trace_key(path, column)
+    if name in missing:
+        return missing[name]
+    if key_sampler.COLUMNS[column]:
+        # UPC-sized numbers, checked against the table in one query
+        candidates = list({rng.randrange(10 ** 11, 10 ** 12)
+                           for i in range(0, MISS_KEYS * 2)})
+    else:
+        candidates = [a + b for a in string.ascii_uppercase
+                      for b in string.ascii_uppercase]
+    present = {row[0] for row in query_executor.fetch_read(
+        path,
+        '''
+        select distinct
+            {0}
+        from
+            Parts
+        where
+            {0} in (select value from json_each(:keys));
+        '''.format(column),
+        {"keys": json.dumps(candidates)})}
+    absent = sorted(key for key in candidates if key not in present)
+    rng.shuffle(absent)
+    missing[name] = absent[:MISS_KEYS]
+    return missing[name]
+
+
+def draw(path, column):
+    keys = keys_of(path, column)
+    if DISTRIBUTION == "uniform":
+        return rng.choice(keys)
+    if DISTRIBUTION == "zipf":
+        return rng.choices(keys, cum_weights=cumulative_zipf(len(keys)))[0]
+    if DISTRIBUTION == "hotspot":
+        hot = max(1, int(len(keys) * HOTSPOT_KEYS))
+        if rng.random() < HOTSPOT_SHARE or hot == len(keys):
+            return keys[rng.randrange(0, hot)]
+        return keys[rng.randrange(hot, len(keys))]
+    if DISTRIBUTION == "sequential":
+        name = trace_key(path, column)
+        if name not in sorted_keys:
+            sorted_keys[name] = sorted(keys)
+        position = positions.get(name, 0)
+        positions[name] = (position + 1) % len(sorted_keys[name])
+        return sorted_keys[name][position]
+    raise ValueError("Unknown key distribution {}".format(DISTRIBUTION))
+
+
+def generate(path, column):
+    if MISS_RATE and rng.random() < MISS_RATE:
+        return rng.choice(missing_keys(path, column))
+    return draw(path, column)
+
+
+def next_key(path, column):
+    # Returns the next lookup key of column for the database at path.
+    with phases.phase("key"):
+        return pick_key(path, column)
+
+
+def pick_key(path, column):
+    name = trace_key(path, column)
+    if TRACE is not None:
+        return next_replayed(name)
+    key = generate(path, column)
+    if RECORD is not None:
+        recorded.append([name[0], column, key])
+    return key
+
+
+def next_replayed(name):
+    if not replay:
+        load_trace(TRACE)
+    keys = replay.get(name)
+    if not keys:
+        raise ValueError("Trace {} has no {} keys for {}".format(
+            TRACE, name[1], name[0]))
+    position = positions.get(name, 0)
+    positions[name] = (position + 1) % len(keys)
+    return keys[position]
+
+
+def load_trace(path) -> None:
+    # One JSON list [database file name, column, key] per line.
+    with open(path) as tracefile:
+        for line in tracefile:
+            if line.strip():
+                file_name, column, key = json.loads(line)
+                replay.setdefault((file_name, column), []).append(key)
+
+
+def write_trace(path) -> None:
+    with open(path, "w") as tracefile:
+        for entry in recorded:
+            tracefile.write(json.dumps(entry) + "\n")
+    print("Trace of {} keys written to {}".format(len(recorded), path))
+
+
+def save_recording() -> None:
+    if RECORD is not None and recorded:
+        write_trace(RECORD)
+
+
+atexit.register(save_recording)
+
+
+def main():
+    # Writes a trace without running any query, e.g. to share one key
+    # stream between several benchmark runs.
+    global DISTRIBUTION, MISS_RATE
+    parser = argparse.ArgumentParser(
+        description="Generate a replayable trace of lookup keys.")
+    parser.add_argument("--tiers", nargs="+", default=["10K"],
+                        choices=list(tiers.TIERS))
+    parser.add_argument("--columns", nargs="+",
+                        default=list(key_sampler.COLUMNS),
+                        choices=list(key_sampler.COLUMNS))
+    parser.add_argument("--count", type=int, default=100000,
+                        help="keys per tier and column")
+    parser.add_argument("--distribution", default=DISTRIBUTION,
+                        choices=DISTRIBUTIONS)
+    parser.add_argument("--miss-rate", type=float, default=MISS_RATE)
+    parser.add_argument("--seed", default=SEED or "0")
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args()
+
+    DISTRIBUTION = args.distribution
+    MISS_RATE = args.miss_rate
+    seed(args.seed)
+    for tier in args.tiers:
+        for column in args.columns:
+            name = trace_key(tiers.TIERS[tier], column)[0]
+            for i in range(0, args.count):
+                recorded.append([name, column, generate(tiers.TIERS[tier],
+                                                        column)])
+    write_trace(args.output)
+    recorded.clear()
+    connection_pool.close_all()
+
+
+if __name__ == "__main__":
+    main()
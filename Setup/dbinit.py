@@ -8,11 +8,20 @@
 # Referenced the official python documentation to read csv
 # https://docs.python.org/3/library/csv.html
 
-from typing import List
+from typing import Iterable, Iterator, List
+import itertools
+import json
 import sqlite3
 import csv
 import os
 import random
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
 
 Connection = sqlite3.Connection
 DB_PATH = "../SQLiteDBs/main.db"
@@ -25,6 +34,44 @@ V1M_DB_PATH = "../SQLiteDBs/A4v1M.db"
 COUNTRY_DATA = "../Data/data_csv.csv"
 UPC_DATA = "../Data/upc_corpus.csv"
 
+# Every tier database and how many parts it gets from main.db.
+TIERS = [(V100_DB_PATH, 100), (V1K_DB_PATH, 1000), (V10K_DB_PATH, 10000),
+         (V100K_DB_PATH, 100000), (V1M_DB_PATH, 1000000)]
+
+# Rows inserted per transaction while populating.
+BATCH_SIZE = int(os.environ.get("DBINIT_BATCH_SIZE", 10000))
+
+# Builds main.db and every tier in one pass over the corpus with journaling
+# and syncing turned off. A crash during the build leaves corrupt files,
+# which is fine since they are simply rebuilt.
+BULK = os.environ.get("DBINIT_BULK", "0") == "1"
+
+# Page cache used during a bulk build, negative values are in KiB.
+BULK_CACHE_SIZE = -262144
+
+# Also builds the CountrySummary table and its triggers in every database
+# (see Applications/summary.py). "only" rebuilds them without touching Parts.
+SUMMARY = os.environ.get("DBINIT_SUMMARY", "0")
+
+# Comma separated storage layouts (see Applications/layouts.py), or "all",
+# built from the existing tier databases into SQLiteDBs/layouts. Nothing
+# else is built when it is set.
+LAYOUTS = os.environ.get("DBINIT_LAYOUTS")
+
+CREATE_TABLE_QUERY = '''
+    CREATE TABLE {schema}.Parts (
+        partNumber INTEGER,
+        -- a UPC code
+        partPrice INTEGER,
+        -- in the [1, 100] range
+        needsPart INTEGER,
+        -- a UPC code
+        madeIn TEXT,
+        -- a country (2 letters) code
+        PRIMARY KEY(partNumber)
+    );
+    '''
+
 
 def connect() -> Connection:
     # Returns a connection to the database provided at the path.
@@ -43,74 +90,109 @@ def exact_path(path) -> str:
     return load_path
 
 
-def load_data(path: str) -> List[str]:
+def stream_data(path: str) -> Iterator[List[str]]:
+    # Yields the valid rows of the csv file one at a time, after the header.
     data_path = exact_path(path)
-    data = []
-    added = set()
-    with open(data_path) as csvfile:
+    with open(data_path, newline='') as csvfile:
         datareader = csv.reader(csvfile)
+        next(datareader, None)
         for row in datareader:
-            if(is_valid_row(added, row, path)):
-                data.append(row)
-                added.add(row[0])
-        csvfile.close()
-    return data[1:]
+            if(is_valid_row(row, path)):
+                yield row
+
 
+def load_data(path: str) -> List[List[str]]:
+    # Only used for small files, duplicate rows are dropped here.
+    data = []
+    added = set()
+    for row in stream_data(path):
+        if row[0] not in added:
+            data.append(row)
+            added.add(row[0])
+    return data
 
-def is_valid_row(added, row, path) -> bool:
+
+def is_valid_row(row, path) -> bool:
     if path is UPC_DATA:
-        return is_valid_upc(added, row)
+        return is_valid_upc(row)
     else:
-        return row[0] not in added
+        return True
+
+
+def is_valid_upc(row) -> bool:
+    # Duplicate UPCs are dropped by the database when they are inserted.
+    return row[0] != 'null' and row[0] != '' and row[0].isdigit() and int(row[0]) <= 2**63-1
+
 
+def batched(rows: Iterable[tuple]) -> Iterator[List[tuple]]:
+    # Groups rows into lists of BATCH_SIZE.
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, BATCH_SIZE))
+        if not batch:
+            return
+        yield batch
 
-def is_valid_upc(added, row) -> bool:
-    return row[0] != 'null' and row[0] != '' and row[0] not in added and row[0].isdigit() and int(row[0]) <= 2**63-1
+
+def insert_batches(connection, query, batches: Iterable[List[tuple]]) -> int:
+    # Inserts each batch in its own transaction.
+    # The connection must be in autocommit mode (isolation_level None).
+    inserted = 0
+    for batch in batches:
+        connection.execute('BEGIN')
+        connection.executemany(query, batch)
+        connection.execute('COMMIT')
+        inserted += len(batch)
+    return inserted
+
+
+def report(step, rows, t_start) -> None:
+    t_taken = time.perf_counter() - t_start
+    rate = rows / t_taken if t_taken else 0
+    print("{}: {} rows in {:.2f} s ({:.0f} rows/sec)".format(
+        step, rows, t_taken, rate))
+
+
+def print_peak_memory() -> None:
+    if resource is None:
+        return
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print("Peak RSS: {} KB".format(peak))
 
 
 def main() -> None:
+    if SUMMARY == "only":
+        make_summaries()
+        return
+    if LAYOUTS:
+        make_layouts()
+        return
     country_data = load_data(COUNTRY_DATA)
-    upc_data = load_data(UPC_DATA)
-    make_main()
-    populate(country_data, upc_data)
-    make_copies()
+    t_start = time.perf_counter()
+    if BULK:
+        bulk_build(country_data, stream_data(UPC_DATA))
+    else:
+        make_main()
+        populate(country_data, stream_data(UPC_DATA))
+        make_copies()
+    if SUMMARY == "1":
+        make_summaries()
+    print("Built every database in {:.2f} s".format(
+        time.perf_counter() - t_start))
+    print_peak_memory()
 
 
 def make_main() -> None:
-    create_table_query = '''
-    CREATE TABLE Parts (
-        partNumber INTEGER,
-        -- a UPC code
-        partPrice INTEGER,
-        -- in the [1, 100] range
-        needsPart INTEGER,
-        -- a UPC code
-        madeIn TEXT,
-        -- a country (2 letters) code
-        PRIMARY KEY(partNumber)
-    );
-    '''
     connection = connect()
-    connection.cursor().execute(create_table_query)
+    connection.cursor().execute(CREATE_TABLE_QUERY.format(schema="main"))
+    connection.close()
 
 
 def make_copies() -> None:
     query = '''
     ATTACH DATABASE :file_name AS new_db;
     '''
-    query1 = '''
-    CREATE TABLE new_db.Parts (
-        partNumber INTEGER,
-        -- a UPC code
-        partPrice INTEGER,
-        -- in the [1, 100] range
-        needsPart INTEGER,
-        -- a UPC code
-        madeIn TEXT,
-        -- a country (2 letters) code
-        PRIMARY KEY(partNumber)
-    );
-    '''
     query2 = '''
     INSERT INTO
         new_db.Parts
@@ -120,46 +202,160 @@ def make_copies() -> None:
         Parts
     limit :amount;
     '''
-    paths = [V100_DB_PATH, V1K_DB_PATH,
-             V10K_DB_PATH, V100K_DB_PATH, V1M_DB_PATH]
-    amounts = [100, 1000, 10000, 100000, 1000000]
-    for i in range(0, 5):
+    for path, amount in TIERS:
         connection = connect()
-        connection.execute(query, {"file_name": exact_path(paths[i])}).execute(
-            query1).execute(query2, {"amount": amounts[i]})
+        connection.execute(query, {"file_name": exact_path(path)}).execute(
+            CREATE_TABLE_QUERY.format(schema="new_db")).execute(
+            query2, {"amount": amount})
+        connection.commit()
+        connection.close()
+
+
+def make_summaries() -> None:
+    # The summary's schema and triggers are shared with the applications.
+    sys.path.insert(0, exact_path("../Applications"))
+    import summary
+    t_start = time.perf_counter()
+    for path in [DB_PATH] + [path for path, amount in TIERS]:
+        if not os.path.exists(exact_path(path)):
+            continue
+        connection = sqlite3.connect(exact_path(path))
+        summary.build(connection)
         connection.commit()
         connection.close()
+    print("Built CountrySummary in {:.2f} s".format(
+        time.perf_counter() - t_start))
+
+
+def make_layouts() -> None:
+    # The layouts are shared with the applications, which read them when
+    # BENCH_LAYOUT is set.
+    sys.path.insert(0, exact_path("../Applications"))
+    import layouts
+    names = layouts.LAYOUTS if LAYOUTS == "all" else LAYOUTS.split(",")
+    for path, amount in TIERS:
+        source = os.path.abspath(exact_path(path))
+        if not os.path.exists(source):
+            continue
+        for name in names:
+            target = layouts.file_path(source, name)
+            t_start = time.perf_counter()
+            layouts.build(source, target, name)
+            print("Built {} in {:.2f} s, {} bytes".format(
+                os.path.basename(target), time.perf_counter() - t_start,
+                os.stat(target).st_size))
+
+
+def load_upc_keys(connection, upc_data: Iterable[List[str]]) -> int:
+    # Every distinct UPC gets a sequential id so needsPart can be drawn
+    # uniformly from the whole corpus without holding it in memory.
+    # Returns how many distinct UPCs there are.
+    connection.execute('''
+    CREATE TEMP TABLE UpcKeys (
+        id INTEGER PRIMARY KEY,
+        upc INTEGER UNIQUE
+    );
+    ''')
+    t_start = time.perf_counter()
+    insert_batches(
+        connection,
+        'INSERT OR IGNORE INTO UpcKeys(upc) VALUES(?);',
+        batched((row[0],) for row in upc_data))
+    upc_data_len = connection.execute(
+        'SELECT count(*) FROM UpcKeys;').fetchone()[0]
+    report("Read UPC corpus", upc_data_len, t_start)
+    return upc_data_len
+
+
+def part_batches(connection, country_data, upc_data_len,
+                 order) -> Iterator[List[tuple]]:
+    # Yields the Parts rows BATCH_SIZE at a time, with UpcKeys read back
+    # in the given order ("id" or "upc").
+    cursor = connection.execute(
+        'SELECT upc FROM UpcKeys ORDER BY {};'.format(order))
+    while True:
+        part_numbers = cursor.fetchmany(BATCH_SIZE)
+        if not part_numbers:
+            return
+        needs_part_ids = [random.randint(1, upc_data_len)
+                          for i in range(0, len(part_numbers))]
+        needs_parts = dict(connection.execute('''
+        SELECT id, upc FROM UpcKeys
+            WHERE id IN (SELECT value FROM json_each(?));
+        ''', (json.dumps(needs_part_ids),)))
+        batch = []
+        for (part_number,), needs_part_i in zip(part_numbers, needs_part_ids):
+            country_code = random.choice(country_data)[1]
+            part_price = random.randint(0, 100)
+            needs_part = needs_parts[needs_part_i]
+            batch.append((part_number, part_price, needs_part, country_code))
+        yield batch
 
 
-def populate(country_data, upc_data) -> None:
+def populate(country_data, upc_data: Iterable[List[str]]) -> None:
     connection = connect()
+    connection.isolation_level = None
+    upc_data_len = load_upc_keys(connection, upc_data)
+
     query = '''
     INSERT INTO Parts
-        VALUES(:partNumber, :partPrice, :needsPart, :madeIn);
+        VALUES(?, ?, ?, ?);
     '''
+    t_start = time.perf_counter()
+    inserted = insert_batches(
+        connection, query,
+        part_batches(connection, country_data, upc_data_len, "id"))
+    report("Populated Parts", inserted, t_start)
+    connection.execute('DROP TABLE temp.UpcKeys;')
+    connection.close()
 
-    upc_data_len = len(upc_data)
-    country_data_len = len(country_data)
-    random.shuffle(country_data)
-    random.shuffle(upc_data)
-    insertions = []
-    for i in range(0, upc_data_len):  # Populate with 1 million entries
-        rand_country_i = random.randint(0, country_data_len-1)
-        country_code = country_data[rand_country_i][1]
-        part_price = random.randint(0, 100)
-        needs_part_i = random.randint(0, upc_data_len-1)
-        part_number = upc_data[i][0]
-        needs_part = upc_data[needs_part_i][0]
-
-        insertions.append({
-            "partNumber": part_number,
-            "partPrice": part_price,
-            "needsPart": needs_part,
-            "madeIn": country_code
-        })
-    connection.executemany(query, insertions)
 
-    connection.commit()
+def bulk_build(country_data, upc_data: Iterable[List[str]]) -> None:
+    # Builds main.db and every tier in a single pass. Rows are written in
+    # partNumber order so the B-tree pages fill sequentially, and the first
+    # rows of that order go to the tiers just like make_copies' limit.
+    connection = connect()
+    connection.isolation_level = None
+    schemas = ["main"]
+    for i, (path, amount) in enumerate(TIERS):
+        schema = "tier{}".format(i)
+        connection.execute('ATTACH DATABASE ? AS {};'.format(schema),
+                           (exact_path(path),))
+        schemas.append(schema)
+    for schema in schemas:
+        connection.execute('PRAGMA {}.journal_mode=OFF;'.format(schema))
+        connection.execute('PRAGMA {}.synchronous=OFF;'.format(schema))
+        connection.execute('PRAGMA {}.cache_size={};'.format(
+            schema, BULK_CACHE_SIZE))
+        connection.execute(CREATE_TABLE_QUERY.format(schema=schema))
+    # temp_store stays at its default: UpcKeys, built from the whole UPC
+    # corpus, can spill to disk, and changing it later would drop UpcKeys.
+
+    upc_data_len = load_upc_keys(connection, upc_data)
+
+    t_start = time.perf_counter()
+    inserted = 0
+    for batch in part_batches(connection, country_data, upc_data_len, "upc"):
+        connection.execute('BEGIN')
+        connection.executemany(
+            'INSERT INTO main.Parts VALUES(?, ?, ?, ?);', batch)
+        for schema, (path, amount) in zip(schemas[1:], TIERS):
+            if inserted < amount:
+                connection.executemany(
+                    'INSERT INTO {}.Parts VALUES(?, ?, ?, ?);'.format(schema),
+                    batch[:amount - inserted])
+        connection.execute('COMMIT')
+        inserted += len(batch)
+    report("Populated every tier", inserted, t_start)
+    connection.execute('DROP TABLE temp.UpcKeys;')
+
+    t_start = time.perf_counter()
+    for schema in schemas:
+        connection.execute('VACUUM {};'.format(schema))
+    connection.execute('ANALYZE;')
+    print("VACUUM and ANALYZE took {:.2f} s".format(
+        time.perf_counter() - t_start))
+    connection.close()
 
 
 if __name__ == "__main__":
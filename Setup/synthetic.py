@@ -0,0 +1,249 @@
+# Builds tier databases from generated parts instead of upc_corpus.csv, so
+# tiers can be larger than the corpus (10M and 100M rows).
+
+# UPC-A and EAN-13 check digits follow the GS1 specification
+# https://www.gs1.org/services/how-calculate-check-digit-manually
+
+from typing import List, Tuple
+import argparse
+import bisect
+import math
+import multiprocessing
+import os
+import random
+import sqlite3
+import time
+
+import dbinit
+
+V10M_DB_PATH = "../SQLiteDBs/A4v10M.db"
+V100M_DB_PATH = "../SQLiteDBs/A4v100M.db"
+
+# Every tier that can be generated and how many parts it gets.
+TIERS = {"100": (dbinit.V100_DB_PATH, 100),
+         "1K": (dbinit.V1K_DB_PATH, 1000),
+         "10K": (dbinit.V10K_DB_PATH, 10000),
+         "100K": (dbinit.V100K_DB_PATH, 100000),
+         "1M": (dbinit.V1M_DB_PATH, 1000000),
+         "10M": (V10M_DB_PATH, 10000000),
+         "100M": (V100M_DB_PATH, 100000000)}
+
+# Share of the parts with a 13 digit EAN-13 code, the rest get a 12 digit
+# UPC-A code.
+EAN_SHARE = float(os.environ.get("SYNTHETIC_EAN_SHARE", 0.3))
+
+# Share of the parts whose needsPart is a part of the same tier; the others
+# need a UPC that is not in Parts, like most corpus rows do.
+NEEDS_INTERNAL = float(os.environ.get("SYNTHETIC_NEEDS_INTERNAL", 0.9))
+
+# Skew of how often a part is needed: the part at rank r is needed with
+# weight 1 / r**FANIN_SKEW, so a few parts are needed by very many others.
+FANIN_SKEW = float(os.environ.get("SYNTHETIC_FANIN_SKEW", 0.8))
+
+# Skew of the country distribution, the same way.
+COUNTRY_SKEW = float(os.environ.get("SYNTHETIC_COUNTRY_SKEW", 1.0))
+
+# Rows generated by one worker task and inserted in one transaction.
+CHUNK_SIZE = 100000
+
+# Rows check_tier() reads back after a tier is built.
+CHECK_ROWS = int(os.environ.get("SYNTHETIC_CHECK_ROWS", 10000))
+
+# Payloads of UPC-A codes (11 digits, so codes have 12) and of EAN-13 codes
+# (12 digits, so codes have 13). Neither starts with 0: a leading zero is
+# lost in an INTEGER column, and an EAN-13 starting with 0 is a UPC-A.
+UPC_SPACE = (10 ** 10, 10 ** 11)
+EAN_SPACE = (10 ** 11, 10 ** 12)
+
+# weighted digit sum of every 4 digit block, the rightmost digit weighted 3
+BLOCK_SUMS = [3 * (b % 10) + (b // 10 % 10) + 3 * (b // 100 % 10) +
+              (b // 1000) for b in range(0, 10000)]
+
+# odd multiplier that spreads row indexes over the jitter of each code
+MIX = 0x9E3779B97F4A7C15
+
+
+def check_digit(payload) -> int:
+    # GS1 check digit of a UPC-A or EAN-13 payload (without the check digit).
+    total = 0
+    while payload:
+        payload, block = divmod(payload, 10000)
+        total += BLOCK_SUMS[block]
+    return (10 - total % 10) % 10
+
+
+def make_layout(rows, seed) -> dict:
+    # Where the codes of a tier go: row i gets a payload in the i-th slot of
+    # its space, so the codes are unique and ascend with i. Codes sit in the
+    # lower half of their slot and the missing needsParts in the upper half.
+    eans = int(rows * EAN_SHARE)
+    upcs = rows - eans
+    layout = {"rows": rows, "upcs": upcs, "seed": seed,
+              "upc_slot": (UPC_SPACE[1] - UPC_SPACE[0]) // max(upcs, 1),
+              "ean_slot": (EAN_SPACE[1] - EAN_SPACE[0]) // max(eans, 1)}
+    if min(layout["upc_slot"], layout["ean_slot"]) < 2:
+        raise ValueError("{} rows do not fit in the UPC space".format(rows))
+    # a multiplier coprime with rows turns a popularity rank into a row, so
+    # popular parts are spread over the whole key range
+    stride = 1000003
+    while math.gcd(stride, rows) != 1:
+        stride += 2
+    layout["rank_stride"] = stride
+    return layout
+
+
+def code(layout, i, missing=False) -> int:
+    # The UPC of row i, or a UPC between it and the next row's that no row
+    # has. Only depends on the layout, so any worker can compute any row's.
+    if i < layout["upcs"]:
+        slot = layout["upc_slot"]
+        base = UPC_SPACE[0] + i * slot
+    else:
+        slot = layout["ean_slot"]
+        base = EAN_SPACE[0] + (i - layout["upcs"]) * slot
+    half = slot // 2
+    jitter = ((i * MIX + layout["seed"]) >> 16) % half
+    payload = base + jitter + (half if missing else 0)
+    return payload * 10 + check_digit(payload)
+
+
+def is_valid_code(value) -> bool:
+    # A 12 digit UPC-A or 13 digit EAN-13 code, the lengths code() makes,
+    # with the right check digit.
+    return (10 ** 11 <= value < 10 ** 13 and
+            check_digit(value // 10) == value % 10)
+
+
+def rank_to_row(layout, rank) -> int:
+    return (rank - 1) * layout["rank_stride"] % layout["rows"]
+
+
+def draw_rank(rng, count, skew) -> int:
+    # A rank in [1, count] with weight 1 / rank**skew, by inverting the
+    # continuous power law.
+    u = rng.random()
+    if abs(skew - 1) < 1e-9:
+        rank = count ** u
+    else:
+        rank = (1 + u * (count ** (1 - skew) - 1)) ** (1 / (1 - skew))
+    return min(count, max(1, int(rank)))
+
+
+def country_weights(country_data) -> Tuple[List[str], List[float]]:
+    # Country codes in a fixed shuffled order with cumulative weights.
+    codes = sorted(row[1] for row in country_data)
+    random.Random(0).shuffle(codes)
+    total = 0.0
+    weights = []
+    for rank in range(1, len(codes) + 1):
+        total += 1 / rank ** COUNTRY_SKEW
+        weights.append(total)
+    return codes, weights
+
+
+def generate_chunk(task) -> List[tuple]:
+    # Rows start to end of the tier, drawn from a generator seeded by the
+    # chunk so the result does not depend on the number of workers.
+    layout, countries, start, end = task
+    codes, weights = countries
+    rng = random.Random("{}:{}".format(layout["seed"], start))
+    rows = []
+    for i in range(start, end):
+        if rng.random() < NEEDS_INTERNAL:
+            needed = rank_to_row(layout, draw_rank(rng, layout["rows"],
+                                                   FANIN_SKEW))
+            needs_part = code(layout, needed)
+        else:
+            needs_part = code(layout, rng.randrange(0, layout["rows"]),
+                              missing=True)
+        country = codes[bisect.bisect_left(weights,
+                                           rng.random() * weights[-1])]
+        rows.append((code(layout, i), rng.randint(0, 100), needs_part,
+                     country))
+    return rows
+
+
+def check_tier(connection, layout) -> None:
+    # Reads back CHECK_ROWS rows drawn at random from the whole tier (every
+    # row of a smaller one) and checks that each is where its code says and
+    # that its codes are valid UPC-A or EAN-13 codes.
+    rows = layout["rows"]
+    if rows <= CHECK_ROWS:
+        indexes = range(0, rows)
+    else:
+        indexes = random.Random(layout["seed"]).sample(range(0, rows),
+                                                       CHECK_ROWS)
+    for i in indexes:
+        expected = code(layout, i)
+        row = connection.execute(
+            'SELECT partNumber, needsPart FROM Parts WHERE partNumber = ?;',
+            (expected,)).fetchone()
+        if row is None or not all(is_valid_code(value) for value in row):
+            raise ValueError("Row {} should have partNumber {}, found "
+                             "{}".format(i, expected, row))
+
+
+def build_tier(pool, workers, path, rows, seed, countries) -> None:
+    db_path = dbinit.exact_path(path)
+    connection = sqlite3.connect(db_path, isolation_level=None)
+    connection.execute('PRAGMA journal_mode=OFF;')
+    connection.execute('PRAGMA synchronous=OFF;')
+    connection.execute('PRAGMA cache_size={};'.format(dbinit.BULK_CACHE_SIZE))
+    connection.execute(dbinit.CREATE_TABLE_QUERY.format(schema="main"))
+
+    layout = make_layout(rows, seed)
+    tasks = [(layout, countries, start, min(start + CHUNK_SIZE, rows))
+             for start in range(0, rows, CHUNK_SIZE)]
+    # a few chunks per worker at a time, so memory stays bounded while the
+    # rows are written in partNumber order
+    window = workers * 2
+    t_start = time.perf_counter()
+    inserted = 0
+    for first in range(0, len(tasks), window):
+        inserted += dbinit.insert_batches(
+            connection, 'INSERT INTO Parts VALUES(?, ?, ?, ?);',
+            pool.imap(generate_chunk, tasks[first:first + window]))
+    dbinit.report("Generated {}".format(os.path.basename(db_path)),
+                  inserted, t_start)
+    check_tier(connection, layout)
+
+    t_start = time.perf_counter()
+    connection.execute('ANALYZE;')
+    connection.close()
+    print("ANALYZE took {:.2f} s, size {} bytes".format(
+        time.perf_counter() - t_start, os.stat(db_path).st_size))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Build tier databases from synthetic parts with valid, "
+                    "unique UPC-A and EAN-13 codes.")
+    parser.add_argument("--tiers", nargs="+", default=["10M", "100M"],
+                        choices=list(TIERS))
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--replace", action="store_true",
+                        help="overwrite tier databases that already exist")
+    args = parser.parse_args()
+
+    countries = country_weights(dbinit.load_data(dbinit.COUNTRY_DATA))
+    t_start = time.perf_counter()
+    with multiprocessing.Pool(args.workers) as pool:
+        for tier in args.tiers:
+            path, rows = TIERS[tier]
+            db_path = dbinit.exact_path(path)
+            if os.path.exists(db_path):
+                if not args.replace:
+                    print("Skipping {}, {} exists (use --replace)".format(
+                        tier, path))
+                    continue
+                os.remove(db_path)
+            build_tier(pool, args.workers, path, rows, args.seed,
+                       countries)
+    print("Built every database in {:.2f} s".format(
+        time.perf_counter() - t_start))
+    dbinit.print_peak_memory()
+
+
+if __name__ == "__main__":
+    main()